@@ -0,0 +1,92 @@
+""" Compare the cooldown heap with the last_use dict it replaced.
+
+Usage: python ltbBenchCooldown.py [--nicks N] [--rate N] [--cooldown SECONDS]
+
+Every one of N distinct nicks uses a command once, --rate commands per
+second apart. The old path checks and updates a last_use dict of local
+datetimes as on_cooldown and flood_update did; the new one checks and
+starts the (scope, nick) keys of a cooldownmod.Cooldowns on a simulated
+monotonic clock. Prints the cost per command and the keys and memory each
+holds at the end. Needs pytz, like the plugin.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+
+import cooldownmod as Cooldown
+import timemod as Time
+
+def old_path(nicks, cooldown):
+    """ on_cooldown and flood_update before cooldownmod, COOLDOWN_GENERAL 0 """
+    last_use = {}
+    cooldown_time = Time.local_time()
+    start = time.time()
+    for nick in nicks:
+        time_now = Time.local_time()
+        if cooldown_time > time_now:
+            continue
+        elif nick in last_use and last_use[nick] > time_now:
+            continue
+        time_now = Time.local_time()
+        cooldown_time = time_now
+        last_use[nick] = time_now + datetime.timedelta(seconds=cooldown)
+    return time.time() - start, last_use
+
+def new_path(nicks, cooldown, rate):
+    """ on_cooldown's checks with the clock advancing 1 / rate per command """
+    cooldowns = Cooldown.Cooldowns()
+    most = 0
+    start = time.time()
+    for i, nick in enumerate(nicks):
+        now = float(i) / rate
+        if not cooldowns.ready(None, now) or not cooldowns.ready((None, nick), now):
+            continue
+        cooldowns.start(None, 0, now)
+        cooldowns.start((None, nick), cooldown, now)
+        if i & 1023 == 0:
+            most = max(most, len(cooldowns))
+    return time.time() - start, cooldowns, max(most, len(cooldowns))
+
+def deep_size(root):
+    """ Bytes of root and everything it holds, each object counted once """
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (tuple, list)):
+            stack.extend(item)
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cooldown tracking for many distinct nicks")
+    parser.add_argument("--nicks", type=int, default=1000000)
+    parser.add_argument("--rate", type=float, default=1000, help="commands per second")
+    parser.add_argument("--cooldown", type=float, default=8, help="COOLDOWN_PER_USER")
+    args = parser.parse_args()
+
+    nicks = ["chatter{0}".format(i) for i in xrange(args.nicks)]
+    old_time, last_use = old_path(nicks, args.cooldown)
+    print "{0:,} nicks, {1:,.0f} commands/s, {2:g}s per user cooldown".format(args.nicks, args.rate, args.cooldown)
+    print "last_use dict: {0:.2f} us per command, {1:,} keys, {2:.1f} MB".format(
+        old_time / args.nicks * 1e6, len(last_use), deep_size(last_use) / 1e6)
+    del last_use
+
+    new_time, cooldowns, most = new_path(nicks, args.cooldown, args.rate)
+    print "Cooldowns:     {0:.2f} us per command, {1:,} keys ({2:,} at most), {3:.1f} MB".format(
+        new_time / args.nicks * 1e6, len(cooldowns), most, deep_size((cooldowns.until, cooldowns.heap)) / 1e6)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+""" Compare command dispatch of ordinary chat lines with the if chain it replaced.
+
+Usage: python ltbBenchDispatch.py [--messages N] [--repeat N]
+
+Runs generated chat lines that are not commands through the old process()
+tail (on_global_cooldown, then route splitting the line and comparing it
+with every command), through commandmod.Router.dispatch with the
+plugin's commands registered, and through the "!" check the bus makes
+before calling Bus.COMMANDS subscribers. Prints the cost per message of
+each. Needs pytz, like the plugin.
+"""
+
+from collections import namedtuple
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+
+import commandmod as Command
+import timemod as Time
+
+Message = namedtuple("Message", "nick host type channel message") # busmod.Message without hexchat
+COMMANDS = ["!ltb", "!seen", "!wctime", "!ectime", "!jptime", "!sapmusic", "!viewers", "!status", "!bookmark"]
+
+cooldown_time = Time.local_time() - datetime.timedelta(seconds=1)
+
+def on_global_cooldown():
+    return cooldown_time > Time.local_time()
+
+def old_route(message):
+    """ route before commandmod, every cmd == ... test failing """
+    command_data = message.split()
+    cmd = command_data[0].lower()
+    for name in COMMANDS:
+        if cmd == name:
+            return True
+    return False
+
+def old_path(data):
+    if not on_global_cooldown():
+        old_route(data.message)
+
+def new_router():
+    router = Command.Router("!", lambda command, data: False)
+    for name in COMMANDS:
+        router.add(name, lambda data, args: None)
+    return router
+
+def per_message(func, chat, repeat):
+    """ Microseconds per message of the fastest of repeat runs """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for data in chat:
+            func(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(chat) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dispatch cost of chat lines that are not commands")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path, the fastest is reported")
+    args = parser.parse_args()
+
+    rand = random.Random(1)
+    words = ["kappa", "pogchamp", "hello", "stream", "game", "what", "is", "this", "gg"]
+    chat = [Message("chatter{0}".format(i), "host", "PRIVMSG", "#channel",
+                    " ".join(rand.choice(words) for j in range(rand.randint(1, 12))))
+            for i in xrange(args.messages)]
+
+    router = new_router()
+    old = per_message(old_path, chat, args.repeat)
+    dispatch = per_message(router.dispatch, chat, args.repeat)
+    bus = per_message(lambda data: data.message.startswith("!") and router.dispatch(data), chat, args.repeat)
+    print "{0:,} chat lines, {1} commands".format(len(chat), len(COMMANDS))
+    print "if chain:        {0:.3f} us per message".format(old)
+    print "Router.dispatch: {0:.3f} us per message ({1:.0f}x)".format(dispatch, old / dispatch)
+    print "Bus.COMMANDS:    {0:.3f} us per message ({1:.0f}x)".format(bus, old / bus)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+""" Compare the in-memory !seen records with the per-message SQL write they replaced.
+
+Usage: python ltbBenchSeen.py [--chatters N] [--messages N] [--flush-every N]
+
+Replays generated chat from N distinct chatters through the old path (a
+rendered sentence REPLACEd into seen per message) and through the records
+db_update keeps, written behind in batches like seen_flush. Prints the
+cost per message, the memory the records take and the database sizes.
+Needs pytz, like the plugin.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+
+import seenmod as Seen
+import timemod as Time
+
+CHANNEL = "#channel"
+
+def messages(chatters, count):
+    rand = random.Random(chatters)
+    words = ["kappa", "pogchamp", "hello", "stream", "game", "what", "is", "this", "gg"]
+    for i in xrange(count):
+        nick = "chatter{0}".format(i if i < chatters else rand.randrange(chatters))
+        yield nick, " ".join(rand.choice(words) for j in range(rand.randint(1, 12)))
+
+def old_path(path, chat):
+    """ db_update before the seen records: render and write every message """
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE seen (nick TEXT UNIQUE, message TEXT)")
+    start = time.time()
+    for nick, message in chat:
+        date = Time.local_time().strftime('%b %d, %Y at %H:%M %Z')
+        msg = u'This user was last seen saying \'{msg}\' on {date}'.format(msg=message, date=date)
+        cursor.execute(u"REPLACE INTO seen (nick, message) VALUES (?, ?)", (nick, msg))
+    connection.commit()
+    elapsed = time.time() - start
+    connection.close()
+    return elapsed
+
+def new_path(path, chat, flush_every):
+    """ db_update and seen_flush as in twitchChatBot.py """
+    connection = sqlite3.connect(path)
+    connection.execute(("CREATE TABLE last_seen (nick TEXT, channel TEXT, time INTEGER, message TEXT, "
+                        "PRIMARY KEY(nick, channel))"))
+    records = {}
+    latest = {}
+    dirty = set()
+
+    def flush():
+        start = time.time()
+        rows = []
+        for key in dirty:
+            record = records[key]
+            rows.append((key[1], record.channel, record.time, record.message.decode('utf-8', 'replace')))
+        connection.executemany(u"REPLACE INTO last_seen (nick, channel, time, message) VALUES (?, ?, ?, ?)", rows)
+        connection.commit()
+        dirty.clear()
+        return time.time() - start
+
+    flushing = 0.0
+    start = time.time()
+    for i, (nick, message) in enumerate(chat):
+        key = (CHANNEL, nick)
+        records[key] = Seen.SeenRecord(int(time.time()), CHANNEL, message)
+        latest[nick] = CHANNEL
+        dirty.add(key)
+        if i % flush_every == flush_every - 1:
+            flushing += flush()
+    flushing += flush()
+    elapsed = time.time() - start
+    connection.close()
+    return elapsed - flushing, flushing, deep_size((records, latest))
+
+def deep_size(root):
+    """ Bytes of root and everything it holds, each object counted once """
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (tuple, list)):
+            stack.extend(item)
+        elif isinstance(item, Seen.SeenRecord):
+            stack.extend((item.time, item.channel, item.message))
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark !seen records against per-message SQL writes")
+    parser.add_argument("--chatters", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=500000)
+    parser.add_argument("--flush-every", type=int, default=5000, help="messages between batched writes")
+    args = parser.parse_args()
+
+    chat = list(messages(args.chatters, max(args.messages, args.chatters)))
+    directory = tempfile.mkdtemp()
+    try:
+        old_db = os.path.join(directory, "old.db")
+        new_db = os.path.join(directory, "new.db")
+        old_time = old_path(old_db, chat)
+        update_time, flush_time, memory = new_path(new_db, chat, args.flush_every)
+        print "{0:,} messages from {1:,} chatters".format(len(chat), args.chatters)
+        print "per message before: {0:.2f} us".format(old_time / len(chat) * 1e6)
+        print "per message with records: {0:.2f} us in db_update + {1:.2f} us in batched writes".format(
+            update_time / len(chat) * 1e6, flush_time / len(chat) * 1e6)
+        print "records in memory: {0:.1f} MB ({1:.0f} bytes per chatter)".format(
+            memory / 1e6, float(memory) / args.chatters)
+        print "database: {0:.1f} MB seen, {1:.1f} MB last_seen".format(
+            os.path.getsize(old_db) / 1e6, os.path.getsize(new_db) / 1e6)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+from collections import namedtuple
+import traceback
+
+import hexchat
+
+import ignoremod as Ignore
+
+ALL = 0 # which lines a subscriber gets
+CHAT = 1 # lines not starting with "!"
+COMMANDS = 2 # lines starting with "!"
+
+class Message(namedtuple("Message", "nick host type channel message")):
+    """ One PRIVMSG line, parsed once per plugin and shared by its subscribers.
+
+    Immutable, so it can be handed to an ingest thread as is.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, line):
+        # :nick!user@host PRIVMSG #channel :message
+        str_data = line.replace("!", " ", 1).split(None, 4)
+        return cls(str_data[0].lstrip(":").lower(), str_data[1], str_data[2], str_data[3], str_data[4][1:])
+
+    @property
+    def is_command(self):
+        return self.message.startswith("!")
+
+class Bus(object):
+    """ One PRIVMSG hook per interpreter that filters ignored users and parses
+    each line once, then calls every subscriber with the Message.
+
+    Subscribers are timed by name in the profiler given to subscribe(), the
+    first one given also times the bus's own "filter" and "parse" stages.
+    """
+
+    def __init__(self):
+        self.subscribers = [] # (name, handler, which lines, profiler or None)
+        self.profiler = None
+        self.hook = None
+        self.errors = 0
+
+    def subscribe(self, name, handler, lines=ALL, profiler=None):
+        self.subscribers.append((name, handler, lines, profiler))
+        if self.profiler is None:
+            self.profiler = profiler
+        if self.hook is None:
+            Ignore.hook()
+            self.hook = hexchat.hook_server('PRIVMSG', self.publish)
+
+    def unsubscribe(self, handler):
+        self.subscribers = [entry for entry in self.subscribers if entry[1] is not handler]
+        if not self.subscribers and self.hook is not None:
+            hexchat.unhook(self.hook)
+            self.hook = None
+
+    def publish(self, word, word_eol, userdata):
+        profiler = self.profiler
+        start = profiler.start() if profiler else None
+        ignored = Ignore.is_ignored(word[0])
+        if profiler:
+            profiler.stop("filter", start)
+        if ignored:
+            return hexchat.EAT_NONE
+
+        start = profiler.start() if profiler else None
+        message = Message.parse(word_eol[0])
+        if profiler:
+            profiler.stop("parse", start)
+        skip = CHAT if message.is_command else COMMANDS
+
+        for name, handler, lines, subscriber_profiler in self.subscribers:
+            if lines == skip:
+                continue
+            start = subscriber_profiler.start() if subscriber_profiler else None
+            try:
+                handler(message)
+            except Exception:
+                # one failing subscriber should not keep the line from the others
+                self.errors += 1
+                traceback.print_exc()
+            if subscriber_profiler:
+                subscriber_profiler.stop(name, start)
+        return hexchat.EAT_NONE
+
+bus = Bus() # one per interpreter, see subscribe()
+
+def subscribe(name, handler, lines=ALL, profiler=None):
+    """ Call handler(Message) for each PRIVMSG line of the given kind (ALL, CHAT or COMMANDS).
+
+    Plugins loaded into the same Python interpreter share the hook and the
+    parse. HexChat's Python 2 plugin gives each script its own interpreter,
+    so there every plugin still has its own bus.
+    """
+    bus.subscribe(name, handler, lines, profiler)
+
+def unsubscribe(handler):
+    bus.unsubscribe(handler)
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache(object):
+    """ Bounded least recently used cache where every entry expires after ttl seconds.
+
+    Safe to invalidate from an ingest thread while the HexChat thread reads.
+    A reader that takes generation() before querying and passes it to put()
+    does not cache a result an invalidation of its key made stale meanwhile.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (expiry time, value), oldest first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale = 0 # puts skipped because their key was invalidated during the read
+        self.changes = 0 # invalidations and clears so far, the current generation
+        self.changed = {} # key -> generation of its last invalidation, bounded by pruning
+        self.floor = 0 # keys not in changed were last invalidated at or before this generation
+
+    def get(self, key):
+        """ Return the cached value or None """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.time():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries[key] = entry # move to most recently used
+            self.hits += 1
+            return entry[1]
+
+    def generation(self):
+        """ Take before reading a value to put() """
+        with self.lock:
+            return self.changes
+
+    def put(self, key, value, generation=None):
+        """ Cache value, unless key was invalidated after generation() returned generation """
+        with self.lock:
+            if generation is not None and self.changed.get(key, self.floor) > generation:
+                self.stale += 1
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+            self.changes += 1
+            self.changed[key] = self.changes
+            if len(self.changed) > 4 * self.maxsize:
+                # forget keys, reads begun before now can no longer tell them apart
+                self.changed.clear()
+                self.floor = self.changes
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.changes += 1
+            self.changed.clear()
+            self.floor = self.changes
+
+    def stats(self):
+        return {"size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "stale": self.stale}
+
+    def summary(self):
+        return ("{size}/{maxsize} entries, {hits} hits, {misses} misses, "
+                "{evictions} evictions, {expirations} expired, "
+                "{invalidations} invalidated, {stale} stale results not cached").format(**self.stats())
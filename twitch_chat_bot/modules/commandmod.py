@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+class Command(object):
+    __slots__ = ("name", "handler", "cooldown", "mod_only", "admin_only", "listed")
+
+    def __init__(self, name, handler, cooldown=True, mod_only=False, admin_only=False, listed=True):
+        self.name = name
+        self.handler = handler # handler(data, args), args is the message split on whitespace
+        self.cooldown = cooldown # checked with the router's on_cooldown
+        self.mod_only = mod_only
+        self.admin_only = admin_only
+        self.listed = listed # shown by listed()
+
+class Router(object):
+    """ Dict dispatch of "!command" messages.
+
+    Messages not starting with the prefix are rejected before any splitting.
+    data is a message with a .message attribute, e.g. a Bus.Message.
+    Permission and cooldown checks are functions of the plugin, called as
+    check(command, data) and run in that order before the handler.
+    """
+
+    def __init__(self, prefix="!", on_cooldown=None, is_mod=None, is_admin=None):
+        self.prefix = prefix
+        self.on_cooldown = on_cooldown
+        self.is_mod = is_mod
+        self.is_admin = is_admin
+        self.commands = OrderedDict() # lowercase name -> Command, in registration order
+
+    def add(self, name, handler, **options):
+        self.commands[name.lower()] = Command(name.lower(), handler, **options)
+
+    def command(self, name, **options):
+        """ Decorator registering a handler, options are those of Command """
+        def register(handler):
+            self.add(name, handler, **options)
+            return handler
+        return register
+
+    def listed(self):
+        return [name for name, command in self.commands.items() if command.listed]
+
+    def dispatch(self, data):
+        """ Run the command in data.message, return True if it was one """
+        message = data.message
+        if not message.startswith(self.prefix):
+            return False
+        args = message.split()
+        command = self.commands.get(args[0].lower())
+        if command is None:
+            return False
+
+        if command.admin_only and not (self.is_admin and self.is_admin(command, data)):
+            return True
+        if command.mod_only and not (self.is_mod and self.is_mod(command, data)):
+            return True
+        if command.cooldown and self.on_cooldown and self.on_cooldown(command, data):
+            return True
+        command.handler(data, args)
+        return True
@@ -0,0 +1,81 @@
+import heapq
+
+import timemod as Time
+
+MAX_KEYS = 50000 # cooldowns tracked at once, the soonest to end are dropped past this
+
+class Cooldowns(object):
+    """ Keys that are blocked until a time on Time.monotonic().
+
+    Ended cooldowns are removed in the order they end, using a heap, so
+    memory is bounded by the keys still cooling down and never more than
+    max_keys. Keys are any hashable, e.g. (command, nick).
+    """
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self.until = {} # key -> time the cooldown ends
+        self.heap = [] # (time, key), stale once a key's cooldown is restarted
+        self.evicted = 0 # dropped before ending because of max_keys
+
+    def __len__(self):
+        return len(self.until)
+
+    def ready(self, key, now=None):
+        """ Return True if key is not cooling down """
+        until = self.until.get(key)
+        if until is None:
+            return True
+        if now is None:
+            now = Time.monotonic()
+        return until <= now
+
+    def remaining(self, key, now=None):
+        """ Seconds left on key's cooldown, 0 if ready """
+        until = self.until.get(key)
+        if until is None:
+            return 0.0
+        if now is None:
+            now = Time.monotonic()
+        return max(0.0, until - now)
+
+    def start(self, key, seconds, now=None):
+        """ Block key for seconds """
+        if now is None:
+            now = Time.monotonic()
+        self.expire(now)
+        if seconds <= 0:
+            return
+        until = now + seconds
+        self.until[key] = until
+        heapq.heappush(self.heap, (until, key))
+        while len(self.until) > self.max_keys:
+            self._pop()
+            self.evicted += 1
+        if len(self.heap) > 2 * len(self.until) + 64:
+            self.heap = [(until, key) for key, until in self.until.iteritems()]
+            heapq.heapify(self.heap)
+
+    def expire(self, now=None):
+        """ Forget cooldowns that have ended """
+        if now is None:
+            now = Time.monotonic()
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            until, key = heapq.heappop(heap)
+            if self.until.get(key) == until:
+                del self.until[key]
+
+    def _pop(self):
+        """ Forget the cooldown that ends soonest """
+        while True:
+            until, key = heapq.heappop(self.heap)
+            if self.until.get(key) == until:
+                del self.until[key]
+                return
+
+    def stats(self):
+        return {"active": len(self.until),
+                "max_keys": self.max_keys,
+                "heap": len(self.heap),
+                "evicted": self.evicted}
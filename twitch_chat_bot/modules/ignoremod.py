@@ -0,0 +1,91 @@
+import re
+
+import hexchat
+
+REFRESH_INTERVAL = 30000 # ms, also catches ignores changed from the GUI
+
+def mask_to_regex(mask):
+    """ Translate an IRC wildcard mask (* and ?) into a regex pattern """
+    if "!" not in mask and "@" not in mask:
+        mask += "!*@*" # bare nickname
+    pattern = ""
+    for c in mask:
+        if c == "*":
+            pattern += ".*"
+        elif c == "?":
+            pattern += "."
+        else:
+            pattern += re.escape(c)
+    return pattern
+
+class IgnoreMatcher(object):
+    """ Snapshot of hexchat's ignore list compiled for fast lookups.
+
+    Masks of the form nick!*@* go into a set of nicknames, anything else is
+    joined into one case insensitive regex over nick!user@host.
+    """
+
+    def __init__(self):
+        self.masks = None
+        self.nicks = frozenset()
+        self.pattern = None
+        self.dirty = True
+
+    def refresh(self):
+        """ Rebuild from hexchat.get_list("ignore") if the masks changed """
+        masks = tuple(item.mask for item in hexchat.get_list("ignore") or [])
+        self.dirty = False
+        if masks == self.masks:
+            return
+        self.masks = masks
+
+        nicks = set()
+        patterns = []
+        for mask in masks:
+            nick, sep, rest = mask.partition("!")
+            if "*" not in nick and "?" not in nick and rest in ("", "*@*"):
+                nicks.add(nick.lower())
+            else:
+                patterns.append(mask_to_regex(mask))
+        self.nicks = frozenset(nicks)
+        if patterns:
+            self.pattern = re.compile("(?:{0})$".format("|".join(patterns)), re.IGNORECASE)
+        else:
+            self.pattern = None
+
+    def is_ignored(self, prefix):
+        """ Return true if nick!user@host (or a bare nick) matches an ignore mask """
+        if self.dirty:
+            self.refresh()
+        prefix = prefix.lstrip(":")
+        nick = prefix.split("!", 1)[0].lower()
+        if nick in self.nicks:
+            return True
+        if self.pattern is None:
+            return False
+        if "!" not in prefix:
+            prefix += "!*@*"
+        return self.pattern.match(prefix) is not None
+
+    def invalidate(self, *args):
+        """ Hook callback, rebuild on the next lookup once the command has run """
+        self.dirty = True
+        return hexchat.EAT_NONE
+
+    def timer_cb(self, userdata):
+        self.dirty = True
+        return 1 # keep hook_timer running
+
+    def hook(self):
+        hexchat.hook_command("ignore", self.invalidate)
+        hexchat.hook_command("unignore", self.invalidate)
+        hexchat.hook_timer(REFRESH_INTERVAL, self.timer_cb)
+
+matcher = IgnoreMatcher()
+
+def hook():
+    """ Keep the shared matcher current, call once when the plugin loads """
+    matcher.hook()
+
+def is_ignored(prefix):
+    return matcher.is_ignored(prefix)
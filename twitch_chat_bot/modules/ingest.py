@@ -0,0 +1,121 @@
+import Queue
+import threading
+
+DROP = "drop"   # discard new lines while the queue is full
+BLOCK = "block" # make the hook wait up to block_timeout for free space
+
+_STOP = object()
+
+class _Call(object):
+    """ A call() job, its own type so no submitted item can be taken for one """
+    __slots__ = ("func", "args", "done")
+
+    def __init__(self, func, args, done):
+        self.func = func
+        self.args = args
+        self.done = done
+
+class IngestWorker(object):
+    """ Background thread that processes raw chat lines off the HexChat thread.
+
+    The handler runs on the worker thread and must not call the hexchat API.
+    Anything that has to run next to the handler (flushes, deletes, owning a
+    sqlite connection) should be sent through call() rather than run directly.
+    Only submitted lines count against maxsize, call() and stop() never wait
+    for space, so the HexChat thread is not held up while the queue is full.
+    """
+
+    def __init__(self, handler, maxsize=2000, policy=DROP, block_timeout=0.05,
+                 on_start=None, on_stop=None, name="ingest"):
+        self.handler = handler
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.maxsize = maxsize
+        self.queue = Queue.Queue() # lines and calls, lines are bounded by depth
+        self.depth = 0 # lines queued, guarded by space
+        self.space = threading.Condition(threading.Lock()) # notified when a line is taken
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def on_worker_thread(self):
+        return threading.current_thread() is self.thread
+
+    def submit(self, line):
+        """ Queue a line (any object, e.g. a Bus.Message), return False if it was dropped """
+        with self.space:
+            if self.depth >= self.maxsize and self.policy == BLOCK:
+                self.space.wait(self.block_timeout)
+            if self.depth >= self.maxsize:
+                self.dropped += 1
+                return False
+            self.depth += 1
+            self.queue.put(line)
+        self.submitted += 1
+        return True
+
+    def call(self, func, args=(), wait=None):
+        """ Run func(*args) on the worker thread, never dropped.
+
+        If wait is given, block up to that many seconds for it to finish and
+        return whether it did.
+        """
+        done = threading.Event()
+        self.queue.put(_Call(func, args, done))
+        if wait is None:
+            return False
+        done.wait(wait)
+        return done.is_set()
+
+    def stop(self, timeout=5.0):
+        """ Process what is already queued, run on_stop and end the thread """
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {"depth": self.depth,
+                "maxsize": self.maxsize,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "last_error": self.last_error}
+
+    def _run(self):
+        if self.on_start:
+            self.on_start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _STOP:
+                    break
+                try:
+                    if isinstance(item, _Call):
+                        try:
+                            item.func(*item.args)
+                        finally:
+                            item.done.set()
+                    else:
+                        with self.space:
+                            self.depth -= 1
+                            self.space.notify()
+                        self.handler(item)
+                        self.processed += 1
+                except Exception as error:
+                    # keep the worker alive, a bad line must not stop ingest.
+                    # printing from this thread is not safe, report via stats()
+                    self.errors += 1
+                    self.last_error = repr(error)
+        finally:
+            if self.on_stop:
+                self.on_stop()
@@ -0,0 +1,120 @@
+from collections import deque
+import logging.handlers
+import re
+import time
+
+import hexchat
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100 # level that logs nothing
+FLUSH_INTERVAL = 1000 # ms between batched prnt calls
+REVALIDATE = 30 # seconds before the cached tab is looked up again
+MAX_BUFFER = 1000 # lines waiting for a flush, older ones are dropped past this
+FILE_MAX_BYTES = 1024 * 1024
+FILE_BACKUPS = 3
+COLOR_RE = re.compile(r'\003\d{0,2}(?:,\d{1,2})?|[\002\017\026\035\037]') # IRC formatting codes
+
+def find_tab(name):
+    """ Return the context of a tab, opening a disconnected server tab if there is none """
+    context = hexchat.find_context(channel=name)
+    if context is None:
+        newtofront = hexchat.get_prefs('gui_tab_newtofront')
+
+        hexchat.command('set -quiet gui_tab_newtofront 0')
+        hexchat.command('newserver -noconnect {0}'.format(name))
+        hexchat.command('set -quiet gui_tab_newtofront {}'.format(newtofront))
+        context = hexchat.find_context(channel=name)
+    return context
+
+class TabLog(object):
+    """ Leveled log printed to a HexChat tab and/or a rotating file.
+
+    Lines are formatted and printed when a hook_timer flushes them, in one
+    prnt per flush, so log() is cheap and safe to call from any thread.
+    Check enabled(level) first to skip building arguments that won't be used.
+    """
+
+    def __init__(self, tab_name, level=INFO, tab=True, file_path=None,
+                 flush_interval=FLUSH_INTERVAL, max_buffer=MAX_BUFFER):
+        self.tab_name = tab_name
+        self.level = level
+        self.tab = tab
+        self.flush_interval = flush_interval
+        self.buffer = deque(maxlen=max_buffer) # (format, args)
+        self.logged = 0 # lines appended, to count those dropped from the full buffer
+        self.flushed = 0
+        self.context = None
+        self.context_time = 0
+        self.file = None
+        if file_path:
+            self.file = logging.handlers.RotatingFileHandler(file_path, maxBytes=FILE_MAX_BYTES,
+                                                             backupCount=FILE_BACKUPS)
+            self.file.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        self.hook = None
+
+    def start(self):
+        if self.hook is None:
+            self.hook = hexchat.hook_timer(self.flush_interval, self._tick)
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, fmt, *args):
+        """ Queue fmt.format(*args), formatted only when printed """
+        if level >= self.level:
+            self.buffer.append((fmt, args))
+            self.logged += 1
+
+    def debug(self, fmt, *args):
+        self.log(DEBUG, fmt, *args)
+
+    def info(self, fmt, *args):
+        self.log(INFO, fmt, *args)
+
+    def warning(self, fmt, *args):
+        self.log(WARNING, fmt, *args)
+
+    def tab_context(self):
+        """ The log tab, looked up again every REVALIDATE seconds in case it was closed """
+        now = time.time()
+        if self.context is None or now - self.context_time > REVALIDATE:
+            self.context = find_tab(self.tab_name)
+            self.context_time = now
+        return self.context
+
+    def flush(self):
+        """ Print waiting lines, must run on the HexChat thread """
+        lines = []
+        while self.buffer:
+            fmt, args = self.buffer.popleft()
+            lines.append(fmt.format(*args) if args else fmt)
+        dropped = self.logged - self.flushed - len(lines)
+        self.flushed = self.logged
+        if dropped > 0:
+            lines.insert(0, u"({0} log lines dropped)".format(dropped))
+        if not lines:
+            return
+
+        if self.tab:
+            context = self.tab_context()
+            if context is not None:
+                context.prnt(u"\n".join(lines))
+        if self.file is not None:
+            for line in lines:
+                self.file.emit(logging.makeLogRecord({"msg": COLOR_RE.sub("", line)}))
+
+    def _tick(self, userdata):
+        self.flush()
+        return 1 # keep hook_timer running
+
+    def close(self):
+        """ Print what is left and stop the timer, call when the plugin unloads """
+        if self.hook is not None:
+            hexchat.unhook(self.hook)
+            self.hook = None
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
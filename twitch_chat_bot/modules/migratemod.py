@@ -0,0 +1,75 @@
+import time
+
+SYNCHRONOUS = "NORMAL" # safe with WAL, a power cut can only lose the last commits
+CACHE_KB = 8192 # page cache per connection
+MMAP_BYTES = 64 * 1024 * 1024
+PROGRESS_INTERVAL = 5 # seconds between "still migrating" reports
+PROGRESS_OPS = 100000 # sqlite VM instructions between progress handler calls
+
+def tune(connection):
+    """ Switch to WAL so readers never block the writer, and set cache pragmas """
+    connection.execute("PRAGMA journal_mode=WAL") # stored in the file, later connections inherit it
+    connection.execute("PRAGMA synchronous={0}".format(SYNCHRONOUS))
+    connection.execute("PRAGMA cache_size=-{0}".format(CACHE_KB))
+    connection.execute("PRAGMA mmap_size={0}".format(MMAP_BYTES))
+    connection.execute("PRAGMA temp_store=MEMORY")
+
+def schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+class ProgressWatch(object):
+    """ sqlite3 progress handler reporting long migration steps every PROGRESS_INTERVAL seconds """
+
+    def __init__(self, progress, label):
+        self.progress = progress
+        self.label = label
+        self.started = time.time()
+        self.reported = self.started
+
+    def __call__(self):
+        now = time.time()
+        if now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self.progress("{0}: still working, {1:.0f}s".format(self.label, now - self.started))
+        return 0 # keep going
+
+def migrate(connection, migrations, name="database", progress=None):
+    """ Run the migrations newer than the database's user_version, return the new version.
+
+    migrations is a list of (version, description, step(cursor)) in order.
+    Each step runs in its own transaction together with its version bump,
+    so an interrupted migration resumes at the step that failed.
+    progress(line) is told about each step and about long running ones.
+    """
+    version = schema_version(connection)
+    pending = [migration for migration in migrations if migration[0] > version]
+    if not pending:
+        return version
+
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None # manage transactions here, so DDL is not auto-committed
+    try:
+        for number, description, step in pending:
+            label = "Migrating {0} to v{1} ({2})".format(name, number, description)
+            started = time.time()
+            if progress:
+                progress(label)
+                connection.set_progress_handler(ProgressWatch(progress, label), PROGRESS_OPS)
+            cursor = connection.cursor()
+            cursor.execute("BEGIN")
+            try:
+                step(cursor)
+                cursor.execute("PRAGMA user_version={0}".format(int(number)))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            finally:
+                if progress:
+                    connection.set_progress_handler(None, 0)
+            if progress:
+                progress("{0}: done in {1:.1f}s".format(label, time.time() - started))
+            version = number
+    finally:
+        connection.isolation_level = isolation_level
+    return version
@@ -0,0 +1,80 @@
+import hexchat
+
+class ModIndex(object):
+    """ Operators (Twitch moderators) of each channel, for O(1) permission checks.
+
+    A channel is read from its user list once, on the first check, and then
+    kept current from MODE +o/-o, PART and JOIN lines. Our own JOIN or the
+    end of a NAMES reply makes the next check read the user list again.
+    """
+
+    def __init__(self):
+        self.mods = {} # channel -> set of lowercase nicks, only for channels read from the user list
+
+    def hook(self):
+        hexchat.hook_server("MODE", self.mode_cb)
+        hexchat.hook_server("PART", self.part_cb)
+        hexchat.hook_server("JOIN", self.join_cb)
+        hexchat.hook_server("366", self.names_end_cb) # RPL_ENDOFNAMES
+
+    def channel_mods(self, channel):
+        channel = channel.lower()
+        mods = self.mods.get(channel)
+        if mods is None:
+            context = hexchat.find_context(channel=channel)
+            users = context.get_list("users") if context is not None else []
+            mods = self.mods[channel] = set(user.nick.lower() for user in users if user.prefix == "@")
+        return mods
+
+    def is_mod(self, channel, nick):
+        return nick.lower() in self.channel_mods(channel)
+
+    def invalidate(self, channel):
+        self.mods.pop(channel.lower(), None)
+
+    def mode_cb(self, word, word_eol, userdata):
+        # :nick!user@host MODE #channel +o-o nick nick
+        if len(word) < 4:
+            return hexchat.EAT_NONE
+        mods = self.mods.get(word[2].lower())
+        if mods is None:
+            return hexchat.EAT_NONE
+        args = iter(word[4:])
+        adding = True
+        for flag in word[3].lstrip(":"):
+            if flag == "+":
+                adding = True
+            elif flag == "-":
+                adding = False
+            elif flag == "o":
+                nick = next(args, "").lower()
+                if adding:
+                    mods.add(nick)
+                else:
+                    mods.discard(nick)
+            elif flag in "vbkeIhaq" or (flag == "l" and adding):
+                next(args, None) # modes with an argument
+        return hexchat.EAT_NONE
+
+    def part_cb(self, word, word_eol, userdata):
+        # :nick!user@host PART #channel
+        mods = self.mods.get(word[2].lstrip(":").lower()) if len(word) > 2 else None
+        if mods is not None:
+            mods.discard(word[0][1:].split("!", 1)[0].lower())
+        return hexchat.EAT_NONE
+
+    def join_cb(self, word, word_eol, userdata):
+        # :nick!user@host JOIN #channel
+        if len(word) > 2 and word[0][1:].split("!", 1)[0].lower() == hexchat.get_info("nick").lower():
+            self.invalidate(word[2].lstrip(":"))
+        return hexchat.EAT_NONE
+
+    def names_end_cb(self, word, word_eol, userdata):
+        # :server 366 me #channel :End of /NAMES list.
+        if len(word) > 3:
+            self.invalidate(word[3])
+        return hexchat.EAT_NONE
+
+    def stats(self):
+        return {"channels": len(self.mods),
+                "mods": sum(len(mods) for mods in self.mods.values())}
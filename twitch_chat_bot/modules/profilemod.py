@@ -0,0 +1,123 @@
+from array import array
+from collections import OrderedDict
+import json
+import time
+
+SAMPLES = 2048 # latest timings kept per stage for percentiles
+
+class Stage(object):
+    """ Call count, total time and the latest timings of one stage, in seconds """
+
+    def __init__(self, samples=SAMPLES):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = array('d', [0.0]) * samples
+        self.next = 0 # ring buffer position
+
+    def add(self, elapsed):
+        # unlocked, a sample can be lost when two threads time the same stage at once
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.samples[self.next] = elapsed
+        self.next = (self.next + 1) % len(self.samples)
+
+    def percentiles(self, points=(50, 95, 99)):
+        kept = sorted(self.samples[:min(self.count, len(self.samples))])
+        if not kept:
+            return [0.0] * len(points)
+        return [kept[min(len(kept) - 1, len(kept) * point // 100)] for point in points]
+
+    def summary(self):
+        p50, p95, p99 = self.percentiles()
+        return OrderedDict([("count", self.count),
+                            ("total_ms", self.total * 1000),
+                            ("mean_ms", self.total * 1000 / self.count if self.count else 0.0),
+                            ("p50_ms", p50 * 1000),
+                            ("p95_ms", p95 * 1000),
+                            ("p99_ms", p99 * 1000),
+                            ("max_ms", self.max * 1000)])
+
+class Profiler(object):
+    """ Per stage timers that can be switched on and off while running.
+
+    Time a block with start = profiler.start() ... profiler.stop("stage", start).
+    When off start() returns None and stop() returns straight away.
+    """
+
+    def __init__(self, stages=()):
+        self.enabled = False
+        self.stages = OrderedDict((name, Stage()) for name in stages)
+
+    def start(self):
+        if self.enabled:
+            return time.time()
+        return None
+
+    def stop(self, name, start):
+        if start is None:
+            return
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        stage.add(time.time() - start)
+
+    def wrap(self, name, func):
+        """ Return func timed as stage name, e.g. for calls made on another thread """
+        def timed(*args, **kwargs):
+            start = self.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.stop(name, start)
+        return timed
+
+    def reset(self):
+        self.stages = OrderedDict((name, Stage()) for name in self.stages)
+
+    def summaries(self):
+        return OrderedDict((name, stage.summary()) for name, stage in self.stages.items())
+
+    def report(self):
+        """ Lines describing every stage that has been timed """
+        lines = []
+        for name, summary in self.summaries().items():
+            if summary["count"]:
+                lines.append(("{0}: {count} calls, {total_ms:.1f} ms total, p50 {p50_ms:.3f} ms, "
+                              "p95 {p95_ms:.3f} ms, p99 {p99_ms:.3f} ms, max {max_ms:.3f} ms").format(name, **summary))
+        return lines or ["Nothing timed yet."]
+
+    def export(self, path):
+        """ Write summaries to path, JSON if it ends in .json and CSV otherwise """
+        summaries = self.summaries()
+        with open(path, 'w') as file:
+            if path.lower().endswith(".json"):
+                json.dump(summaries, file, indent=2)
+            else:
+                file.write("stage,count,total_ms,mean_ms,p50_ms,p95_ms,p99_ms,max_ms\n")
+                for name, summary in summaries.items():
+                    file.write(",".join([name] + [str(value) for value in summary.values()]) + "\n")
+
+    def command(self, args):
+        """ Handle [on|off|reset|show|export PATH] of a profile command, return lines to print """
+        action = args[0].lower() if args else "show"
+        if action == "on":
+            self.enabled = True
+            return ["Profiling on."]
+        elif action == "off":
+            self.enabled = False
+            return ["Profiling off."]
+        elif action == "reset":
+            self.reset()
+            return ["Profile timings cleared."]
+        elif action == "show":
+            return self.report()
+        elif action == "export" and len(args) == 2:
+            try:
+                self.export(args[1])
+            except IOError as error:
+                return ["Could not write {0}: {1}".format(args[1], error)]
+            return ["Profile written to " + args[1]]
+        return ["Usage: on | off | reset | show | export PATH(.csv or .json)"]
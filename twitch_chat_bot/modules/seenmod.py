@@ -0,0 +1,17 @@
+import timemod as Time
+
+class SeenRecord(object):
+    """ Last line of a user, rendered into a sentence only when !seen asks """
+    __slots__ = ("time", "channel", "message")
+
+    def __init__(self, timestamp, channel, message):
+        self.time = timestamp # unix time
+        self.channel = channel
+        self.message = message
+
+    def render(self, with_channel=False):
+        date = Time.local_from_timestamp(self.time).strftime('%b %d, %Y at %H:%M %Z')
+        where = u" in {0}".format(self.channel) if with_channel else u""
+        return u'This user was last seen saying \'{msg}\'{where} on {date}'.format(msg=self.message,
+                                                                                 where=where,
+                                                                                 date=date)
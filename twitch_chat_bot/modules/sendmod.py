@@ -0,0 +1,125 @@
+from collections import deque
+import time
+
+import hexchat
+
+import timemod as Time
+
+RATE = 10 # messages per PER seconds for each plugin, half of Twitch's 20 for accounts that are not moderators
+PER = 30 # HexChat gives each plugin its own interpreter, so twitchChatBot and wordCounter each get RATE
+TICK = 100 # ms between send attempts while messages are waiting
+LANE_SIZE = 20 # messages waiting per lane before new ones are dropped
+MAX_AGE = 30 # seconds before a waiting reply is not worth sending anymore
+ADMIN = 0 # lanes, lower is sent first
+NORMAL = 1
+
+class SendWindow(object):
+    """ Allows rate sends in any per seconds, a sliding window of send times """
+
+    def __init__(self, rate=RATE, per=PER):
+        self.rate = rate
+        self.per = per
+        self.sent = deque() # time of each send in the last per seconds
+
+    def take(self):
+        now = Time.monotonic()
+        while self.sent and now - self.sent[0] >= self.per:
+            self.sent.popleft()
+        if len(self.sent) < self.rate:
+            self.sent.append(now)
+            return True
+        return False
+
+windows = {} # network -> SendWindow, shared by every Outbox in this Python interpreter
+
+def window_for(network):
+    window = windows.get(network)
+    if window is None:
+        window = windows[network] = SendWindow()
+    return window
+
+class Outbox(object):
+    """ Queue of messages to say, sent as fast as the network's SendWindow allows.
+
+    Messages wait in priority lanes and are sent in the context (channel)
+    they were queued from. An identical message already waiting for the same
+    channel is merged into it. A hook_timer drains the lanes and only runs
+    while messages are waiting.
+    """
+
+    def __init__(self, lane_size=LANE_SIZE, max_age=MAX_AGE):
+        self.lane_size = lane_size
+        self.max_age = max_age
+        self.lanes = (deque(), deque()) # ADMIN, NORMAL lanes of (key, context, queued time, text)
+        self.waiting = set() # (network, channel, text) of queued messages
+        self.hook = None
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def say(self, text, priority=NORMAL):
+        """ Queue text for the current channel, False if merged or dropped """
+        context = hexchat.get_context()
+        key = (context.get_info("network"), context.get_info("channel"), text)
+        if key in self.waiting:
+            self.merged += 1
+            return False
+        lane = self.lanes[priority]
+        if len(lane) >= self.lane_size:
+            self.dropped += 1
+            return False
+        lane.append((key, context, time.time(), text))
+        self.waiting.add(key)
+        self.drain()
+        if self.hook is None and self.depth():
+            self.hook = hexchat.hook_timer(TICK, self._tick)
+        return True
+
+    def drain(self):
+        """ Send waiting messages, highest priority first, until a window is full """
+        now = time.time()
+        for lane in self.lanes:
+            while lane:
+                key, context, queued, text = lane[0]
+                if now - queued > self.max_age:
+                    lane.popleft()
+                    self.waiting.discard(key)
+                    self.expired += 1
+                    continue
+                if not window_for(key[0]).take():
+                    return
+                lane.popleft()
+                self.waiting.discard(key)
+                context.command("say " + text)
+                self.sent += 1
+
+    def _tick(self, userdata):
+        self.drain()
+        if not self.depth():
+            self.hook = None
+            return 0 # nothing left to send, remove hook_timer
+        return 1
+
+    def depth(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def close(self):
+        """ Drop waiting messages and stop the timer, call when the plugin unloads """
+        if self.hook is not None:
+            hexchat.unhook(self.hook)
+            self.hook = None
+        for lane in self.lanes:
+            lane.clear()
+        self.waiting.clear()
+
+    def stats(self):
+        return {"waiting": self.depth(),
+                "sent": self.sent,
+                "merged": self.merged,
+                "dropped": self.dropped,
+                "expired": self.expired}
+
+    def summary(self):
+        return ("{waiting} waiting, {sent} sent, {merged} merged, "
+                "{dropped} dropped, {expired} expired").format(**self.stats())
@@ -1,36 +1,100 @@
+from collections import OrderedDict
+import ctypes
+import ctypes.util
 import datetime
+import os
+import sys
+import time
+
 import pytz
 
 time_fmt = "%H:%M %Z. %B %d, %Y"
+UTC = pytz.utc
+LOCAL_ZONE = pytz.timezone('US/Pacific') # resolved once, pytz lookups are slow
+
+def _monotonic_clock():
+    """ Return a function giving seconds that never go backwards, e.g. when the system clock is set """
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+    try:
+        if os.name == 'nt':
+            tick = ctypes.windll.kernel32.GetTickCount64
+            tick.restype = ctypes.c_ulonglong
+            return lambda: tick() / 1000.0
+        if not sys.platform.startswith("linux"):
+            return time.time # CLOCK_MONOTONIC has another id elsewhere, e.g. 6 on macOS
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"),
+                                    use_errno=True).clock_gettime
+        CLOCK_MONOTONIC = 1 # linux
+        spec = timespec()
+
+        def monotonic():
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec))
+            return spec.tv_sec + spec.tv_nsec * 1e-9
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec)) != 0:
+            return time.time # clock not available, spec would stay 0 forever
+        return monotonic
+    except (AttributeError, OSError, TypeError):
+        return time.time # no monotonic clock found, fall back to wall time
+
+monotonic = _monotonic_clock()
+
+class ZoneClock(object):
+    """ Current time in one zone as label + time_fmt, rendered at most once a minute """
+    __slots__ = ("zone", "label", "minute", "text")
+
+    def __init__(self, zone_name, label=""):
+        self.zone = pytz.timezone(zone_name)
+        self.label = label
+        self.minute = None
+        self.text = None
+
+    def now_text(self):
+        now = time.time()
+        minute = int(now) // 60
+        if minute != self.minute:
+            # fromtimestamp with a pytz zone goes through fromutc, so DST is handled
+            self.text = self.label + datetime.datetime.fromtimestamp(now, self.zone).strftime(time_fmt)
+            self.minute = minute
+        return self.text
+
+PACIFIC = ZoneClock("Canada/Pacific", "Local time in Vancouver: ")
+EASTERN = ZoneClock("Canada/Eastern", "Local time in New York: ")
+JAPAN = ZoneClock("Japan", "Local time in Japan: ")
+zone_commands = OrderedDict([("!wctime", PACIFIC), ("!ectime", EASTERN), ("!jptime", JAPAN)]) # "!<zone>time" -> ZoneClock
+
+def register(command, zone_name, city):
+    """ Answer command with the local time of city in zone_name, e.g. register("!jptime", "Japan", "Japan") """
+    zone_commands[command.lower()] = ZoneClock(zone_name, "Local time in {0}: ".format(city))
+
+def zone_time(command):
+    """ Return the reply to a registered time command, None for any other command """
+    clock = zone_commands.get(command)
+    if clock is None:
+        return None
+    return clock.now_text()
 
 def utc_time():
     """ Return current time in UTC """
-    utc_dt = datetime.datetime.utcnow()
-    utc_dt = utc_dt.replace(tzinfo=pytz.timezone('UTC'))
-    return utc_dt
+    return datetime.datetime.now(UTC)
 
 def local_time():
     """ Return current time according to the Pacific time zone """
-    loc_dt = datetime.datetime.now(pytz.timezone('US/Pacific'))
-    return loc_dt
-    
+    return datetime.datetime.now(LOCAL_ZONE)
+
+def local_from_timestamp(timestamp):
+    """ Return a unix timestamp as a datetime in the Pacific time zone """
+    return datetime.datetime.fromtimestamp(timestamp, LOCAL_ZONE)
+
 def pacific_time():
-    utc_dt = utc_time()
-    
-    pst_tz = pytz.timezone('Canada/Pacific')
-    pst_dt = pst_tz.normalize(utc_dt.astimezone(pst_tz))
-    return "Local time in Vancouver: " + pst_dt.strftime(time_fmt)
+    return PACIFIC.now_text()
 
 def eastern_time():
-	utc_dt = utc_time()
-
-	est_tz = pytz.timezone('Canada/Eastern')
-	est_dt = est_tz.normalize(utc_dt.astimezone(est_tz))
-	return "Local time in New York: " + est_dt.strftime(time_fmt)
+    return EASTERN.now_text()
 
 def japan_time():
-    utc_dt = utc_time()
-
-    jpn_tz = pytz.timezone('Japan')
-    jpn_dt = jpn_tz.normalize(utc_dt.astimezone(jpn_tz))
-    return "Local time in Japan: " + jpn_dt.strftime(time_fmt)
\ No newline at end of file
+    return JAPAN.now_text()
@@ -1,34 +1,162 @@
+import Queue
+import threading
+import time
+
 import hexchat
-import pytz
 import requests
 
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 
+import cachemod as Cache
+import timemod as Time
+
+API_ROOT = 'https://api.twitch.tv' # point at a local stub server for offline testing
+TIMEOUT = (3.05, 5) # seconds to connect, seconds to read
+CACHE_TTL = 5 # seconds that repeated !viewers / !status calls share one response
+POLL_INTERVAL = 100 # ms between checks for finished background calls
+STOP_TIMEOUT = 10 # seconds to wait for a running call when the plugin unloads, longer than TIMEOUT
+BOOKMARK_LIST = "http://www.twitch.tv/low_tier_bot/profile/bookmarks"
+USERNAME_FIELD = "login_user_login"
+PASSWORD_FIELD = "password"
+BOOKMARK_XPATH = "//span[text()=\"Bookmark\"]"
+LOGIN_XPATH = "//span[text()=\"Log In\"]"
+TITLE_XPATH = "//input[contains(@class, \"js-title\")]"
+RESULT_XPATH = "//input[contains(@value,\"twitch.tv/m/\")]"
+SUBMIT_XPATH = '//button[@type="submit"]'
+BOOKMARK_CLOCK = Time.ZoneClock('Canada/Pacific') # untitled bookmarks are named after the time
+
+class TwitchClient(object):
+    """ Pooled connection to the Twitch API with a short response cache """
+
+    def __init__(self, api_root=API_ROOT, timeout=TIMEOUT, cache_ttl=CACHE_TTL):
+        self.api_root = api_root
+        self.timeout = timeout
+        self.session = requests.Session() # keeps connections alive between calls
+        self.cache = Cache.LRUCache(64, cache_ttl)
+
+    def get(self, path, headers):
+        """ Return the response for api_root + path, or None if Twitch did not answer """
+        url = self.api_root + path
+        resp = self.cache.get(url)
+        if resp is None:
+            try:
+                resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.RequestException:
+                return None
+            self.cache.put(url, resp)
+        return resp
+
+class Executor(object):
+    """ Background thread for blocking calls.
+
+    Results are handed back to the HexChat thread by a hook_timer that only
+    runs while calls are pending, and callbacks run in the context (channel)
+    the call was submitted from. stop() must be called before the plugin
+    unloads, HexChat cannot end a script's interpreter while its threads run.
+    """
+
+    def __init__(self, maxsize=20, name="twitch_api"):
+        self.maxsize = maxsize
+        self.jobs = Queue.Queue() # unbounded so stop() never blocks, submit() checks maxsize
+        self.done = Queue.Queue()
+        self.pending = 0
+        self.hook = None
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, func, args, callback):
+        """ Run func(*args) in the background then callback(result), False if too busy """
+        if self.stopping or self.pending >= self.maxsize:
+            return False
+        self.jobs.put((func, args, callback, hexchat.get_context()))
+        self.pending += 1
+        if self.hook is None:
+            self.hook = hexchat.hook_timer(POLL_INTERVAL, self._poll)
+        return True
+
+    def stop(self, final=None, timeout=STOP_TIMEOUT):
+        """ Skip queued calls, run final() on the worker thread after the running call and join it.
+        Returns False if the running call did not finish within timeout. """
+        self.stopping = True
+        if self.hook is not None:
+            hexchat.unhook(self.hook)
+            self.hook = None
+        self.jobs.put((None, final, None, None))
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def _run(self):
+        while True:
+            func, args, callback, context = self.jobs.get()
+            if func is None: # stop(), args is its final function
+                if args is not None:
+                    try:
+                        args()
+                    except Exception:
+                        pass # nothing can be reported from here while unloading
+                return
+            if self.stopping:
+                continue
+            try:
+                result, error = func(*args), None
+            except Exception as error:
+                result = None
+            self.done.put((callback, context, result, error))
+
+    def _poll(self, userdata):
+        while True:
+            try:
+                callback, context, result, error = self.done.get_nowait()
+            except Queue.Empty:
+                break
+            self.pending -= 1
+            if context is not None:
+                context.set()
+            if error is not None:
+                print "ERROR: Twitch API call failed: {0}".format(error)
+            else:
+                callback(result)
+
+        if self.pending == 0:
+            self.hook = None
+            return 0 # nothing left to wait for, remove hook_timer
+        return 1
+
+client = TwitchClient()
+executor = None # started on first use, so importing twitchmod creates no thread
+
+def run_async(func, args, callback):
+    """ Call func(*args) off the HexChat thread and pass the result to callback """
+    global executor
+    if executor is None:
+        executor = Executor()
+    return executor.submit(func, args, callback)
+
 def is_valid_resp(resp):
-    if resp.status_code == 200:
+    if resp is not None and resp.status_code == 200:
         return True
     return False
 
 def get_stream_info(channel):
-    url = 'https://api.twitch.tv/kraken/streams/{0}'.format(channel)
+    path = '/kraken/streams/{0}'.format(channel)
     headers = {'accept': 'application/vnd.twitchtv.v3+json'}
-    resp = requests.get(url, headers=headers)
-    return resp
+    return client.get(path, headers)
 
 def get_host_info(channel):
     """ Undocumented API. Subject to change/removal without notice """
-    url = 'http://api.twitch.tv/api/users/saprol/followed/hosting'
+    path = '/api/users/saprol/followed/hosting'
     headers = {'accept': 'application/json'}
-    resp = requests.get(url, headers=headers)
-    return resp
+    return client.get(path, headers)
   
 def get_channel_views(channel, nick):
     resp = get_stream_info(channel)
-    resp_json = resp.json()
     if not is_valid_resp(resp):
         return "{0} -> Twitch API is not currently available.".format(nick)
+    resp_json = resp.json()
     
     if resp_json['stream']:
         viewers = resp_json['stream']['viewers']
@@ -38,9 +166,9 @@ def get_channel_views(channel, nick):
 
 def get_hosted_channel(channel, nick):
     resp = get_host_info(channel)
-    resp_json = resp.json()
     if not is_valid_resp(resp):
         return "{0} -> Twitch API is not currently available.".format(nick)
+    resp_json = resp.json()
 
     if resp_json['_total'] == 0:
         return ""
@@ -65,68 +193,177 @@ def create_twitch_bookmark_title(channel, bookmark_name):
     if title:
         bookmark_title = title
     else:
-        utc_dt = utc_time()
-        pst_tz = pytz.timezone('Canada/Pacific')
-        pst_dt = pst_tz.normalize(utc_dt.astimezone(pst_tz))
-        bookmark_title = pst_dt.strftime(time_fmt)
+        bookmark_title = BOOKMARK_CLOCK.now_text()
 
     return bookmark_title
 
-def create_twitch_bookmark(channel, bookmark_name, nick, password_file):
-    """ No API feature -> Automate browser to create TwitchTV bookmark """
-    resp = get_stream_info(channel)
-    if not resp.json()['stream']:
-        hexchat.command("say {user} -> Stream is not running.".format(user=nick))
-        return
+def say_now(line):
+    hexchat.command("say " + line)
 
-    hexchat.command("say {user} -> Attempting to create bookmark. Please wait.".format(user=nick))
+def chrome_driver():
     driver = webdriver.Chrome(executable_path="E:\chromedriver.exe")
     driver.set_window_size(1280, 720)
-    wait = WebDriverWait(driver, 15)    
-
-    with open(password_file, 'r') as file:
-        bot_password = file.read()
-
-    bookmark_title = create_twitch_bookmark_title(channel, bookmark_name)
-    username_field = "login_user_login"
-    password_field = "password"
-    bookmark_xpath = "//span[text()=\"Bookmark\"]"
-    login_xpath = "//span[text()=\"Log In\"]"
-    title_xpath = "//input[contains(@class, \"js-title\")]"
-    result_xpath = "//input[contains(@value,\"twitch.tv/m/\")]"
-    submit_xpath = '//button[@type="submit"]'
-    created_bookmark = False
-    
-    try:
-        driver.get("http://www.twitch.tv/{0}".format(channel[1:]))
-        # Login
-        driver.find_element_by_xpath(login_xpath).click()
-        wait.until(lambda driver: driver.find_element_by_id(username_field))
-        driver.find_element_by_id(username_field).clear()
-        driver.find_element_by_id(username_field).send_keys("low_tier_bot")
-        driver.find_element_by_id(password_field).clear()
-        driver.find_element_by_id(password_field).send_keys(bot_password)
+    return driver
+
+class BookmarkJob(object):
+    __slots__ = ("channel", "title", "nicks", "queued_at")
+
+    def __init__(self, channel, title, nick):
+        self.channel = channel
+        self.title = title
+        self.nicks = [nick]
+        self.queued_at = time.time()
+
+class BookmarkQueue(object):
+    """ No API feature -> Automate browser to create TwitchTV bookmarks in the background.
+
+    One browser session is logged in once and reused by every job. Requests
+    for a channel that already has a bookmark pending join that job instead
+    of creating another. driver_factory can return a fake driver for testing,
+    say(line) sends replies to the current channel.
+    """
+
+    def __init__(self, password_file, driver_factory=chrome_driver, maxsize=5, say=say_now):
+        self.password_file = password_file
+        self.say = say
+        self.driver_factory = driver_factory
+        self.driver = None
+        self.executor = Executor(maxsize, "bookmarks") # the only thread that touches driver
+        self.pending = {} # channel -> BookmarkJob, only touched on the HexChat thread
+        self.submitted = 0
+        self.coalesced = 0
+        self.created = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+
+    def request(self, channel, bookmark_name, nick):
+        job = self.pending.get(channel)
+        if job is not None:
+            job.nicks.append(nick)
+            self.coalesced += 1
+            self.say("{user} -> Bookmark \"{name}\" is already being created.".format(
+                user=nick, name=job.title))
+            return
+
+        job = BookmarkJob(channel, create_twitch_bookmark_title(channel, bookmark_name), nick)
+        if not self.executor.submit(self.create, (job,), self.finished):
+            self.say("{user} -> Too many bookmarks pending, try again later.".format(user=nick))
+            return
+        self.pending[channel] = job
+        self.submitted += 1
+        self.say("{user} -> Attempting to create bookmark. Please wait.".format(user=nick))
+
+    def finished(self, result):
+        job, bookmark_url = result
+        del self.pending[job.channel]
+        latency = time.time() - job.queued_at
+        self.last_latency = latency
+        self.total_latency += latency
+        users = ", ".join(job.nicks)
+
+        if bookmark_url is None:
+            self.say("{user} -> Stream is not running.".format(user=users))
+        elif bookmark_url:
+            self.created += 1
+            self.say("{user} -> Bookmark \"{name}\" created: {url} | {list}".format(name=job.title,
+                                                                                    url=bookmark_url,
+                                                                                    user=users,
+                                                                                    list=BOOKMARK_LIST))
+        else:
+            self.failed += 1
+            self.say("{user} -> Unable to create bookmark \"{name}\".".format(name=job.title,
+                                                                              user=users))
+
+    def create(self, job):
+        """ Runs on the executor thread, returns (job, url), url is None if offline and "" on failure """
+        resp = get_stream_info(job.channel[1:])
+        try:
+            if not is_valid_resp(resp) or not resp.json()['stream']:
+                return job, None
+        except ValueError: # body was not JSON
+            return job, ""
+
+        try:
+            driver = self.session()
+            wait = WebDriverWait(driver, 15)
+            driver.get("http://www.twitch.tv/{0}".format(job.channel[1:]))
+            if driver.find_elements_by_xpath(LOGIN_XPATH):
+                self.login(driver, wait)
+
+            # Create bookmark
+            wait.until(lambda driver: driver.find_element_by_xpath(BOOKMARK_XPATH))
+            driver.find_element_by_xpath(BOOKMARK_XPATH).click()
+            wait.until(lambda driver: driver.find_element_by_xpath(TITLE_XPATH))
+            title_form = driver.find_element_by_xpath(TITLE_XPATH)
+            title_form.clear()
+            title_form.send_keys(job.title)
+            driver.find_element_by_xpath(SUBMIT_XPATH).click()
+            wait.until(lambda driver: driver.find_element_by_xpath(RESULT_XPATH))
+            return job, driver.find_element_by_xpath(RESULT_XPATH).get_attribute("value")
+        except Exception:
+            self.quit_driver() # start from a fresh browser next time
+            return job, ""
+
+    def session(self):
+        if self.driver is None:
+            self.driver = self.driver_factory()
+        return self.driver
+
+    def login(self, driver, wait):
+        with open(self.password_file, 'r') as file:
+            bot_password = file.read()
+
+        driver.find_element_by_xpath(LOGIN_XPATH).click()
+        wait.until(lambda driver: driver.find_element_by_id(USERNAME_FIELD))
+        driver.find_element_by_id(USERNAME_FIELD).clear()
+        driver.find_element_by_id(USERNAME_FIELD).send_keys("low_tier_bot")
+        driver.find_element_by_id(PASSWORD_FIELD).clear()
+        driver.find_element_by_id(PASSWORD_FIELD).send_keys(bot_password)
         driver.find_element_by_xpath("//button[contains(text(), 'Log In')]").click()
-        wait.until(lambda driver: len(driver.find_elements_by_xpath(login_xpath)) == 0)
-
-        # Create bookmark
-        wait.until(lambda driver: driver.find_element_by_xpath(bookmark_xpath))
-        driver.find_element_by_xpath(bookmark_xpath).click()
-        wait.until(lambda driver: driver.find_element_by_xpath(title_xpath))
-        title_form = driver.find_element_by_xpath(title_xpath)
-        title_form.clear()
-        title_form.send_keys(bookmark_title)
-        driver.find_element_by_xpath(submit_xpath).click()
-        wait.until(lambda driver: driver.find_element_by_xpath(result_xpath))
-        bookmark_url = driver.find_element_by_xpath(result_xpath).get_attribute("value")
-        created_bookmark = True
-        hexchat.command("say {user} -> Bookmark \"{name}\" created: {url} | {list}".format(name=bookmark_title, 
-                                                                                           url=bookmark_url,
-                                                                                           user=nick,
-                                                                                           list="http://www.twitch.tv/low_tier_bot/profile/bookmarks"))
-    finally:
-        driver.quit()
-        
-    if not created_bookmark:
-        hexchat.command("say {user} -> Unable to create bookmark \"{name}\".".format(name=bookmark_title,
-                                                                                     user=nick))
\ No newline at end of file
+        wait.until(lambda driver: len(driver.find_elements_by_xpath(LOGIN_XPATH)) == 0)
+
+    def close(self):
+        """ Stop the executor, then quit the browser as its final job so a running job keeps its driver """
+        self.executor.stop(final=self.quit_driver)
+
+    def quit_driver(self):
+        """ Runs on the executor thread """
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            finally:
+                self.driver = None
+
+    def stats(self):
+        finished = self.created + self.failed
+        return {"queued": len(self.pending),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "created": self.created,
+                "failed": self.failed,
+                "last_latency": self.last_latency,
+                "avg_latency": self.total_latency / finished if finished else 0.0}
+
+bookmarks = None # BookmarkQueue, created by the first !bookmark
+
+def bookmark_stats():
+    if bookmarks is None:
+        return None
+    return bookmarks.stats()
+
+def close():
+    """ Stop the background threads and quit the bookmark browser, call when the plugin unloads """
+    global executor
+    if executor is not None:
+        executor.stop()
+        executor = None
+    if bookmarks is not None:
+        bookmarks.close()
+
+def create_twitch_bookmark(channel, bookmark_name, nick, password_file, say=say_now):
+    """ Queue a bookmark for channel, replies are sent with say(line) when the browser is done """
+    global bookmarks
+    if bookmarks is None:
+        bookmarks = BookmarkQueue(password_file, say=say)
+    bookmarks.request(channel, bookmark_name, nick)
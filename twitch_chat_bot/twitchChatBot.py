@@ -1,13 +1,13 @@
 __module_name__ = "TwitchTV Chat Bot"
-__module_version__ = "1.3"
+__module_version__ = "1.4"
 __module_description__ = "Miscellaneous chat bot features"
 
 import codecs
-import datetime
 import os
 import string
 import sqlite3
 import sys
+import time
 
 import hexchat
 import requests
@@ -15,6 +15,16 @@ import requests
 sys.path.append(os.path.join(
     hexchat.get_info('configdir'), 'addons', 'modules'))
 
+import busmod as Bus
+import cachemod as Cache
+import commandmod as Command
+import cooldownmod as Cooldown
+import ingest as Ingest
+import migratemod as Migrate
+import permmod as Perm
+import profilemod as Profile
+import seenmod as Seen
+import sendmod as Send
 import timemod as Time
 import twitchmod as Twitch
 
@@ -30,48 +40,49 @@ FB2K_NOW_PLAYING_FILE = 'E:\Pictures\Stream\currentsong/fb2k_nowPlaying_simple.t
 YOUTUBE_NOW_PLAYING_FILE = 'E:\Pictures\Stream\currentsong/nowplaying_youtube_chat.txt'
 PASS_FILE = "E:\Git/xchat-plugins/twitch_pass.txt"
 COOLDOWN_PER_USER = 8
-COOLDOWN_GENERAL = 6
+COOLDOWN_GENERAL = 0 # replies wait in the outbox for Twitch's rate limit instead, raise to also drop commands
+MODS_SKIP_COOLDOWN = False # channel moderators are never on cooldown
+COMMAND_COOLDOWNS = {"!bookmark": (30, 60)} # command -> (general, per user) seconds, counted apart from other commands
 BOT_LIST = ["kazukimouto", "nightbot", "brettbot", "rise_bot", "dj_jm09", "palebot"]
 ADMIN_ACCESS = ["low_tier_bot", "saprol"] # debugging purposes
 LOW_WIDTH_SPACE = u"\uFEFF" # insert into nicknames to avoid highlighting user extra times
+THREADED_INGEST = False # record seen lines on a background thread instead of the HexChat thread
+INGEST_QUEUE_SIZE = 2000
+INGEST_POLICY = Ingest.DROP # or Ingest.BLOCK to hold up the hook while the queue is full
+SYNC_TIMEOUT = 2.0 # seconds to wait for the ingest thread to catch up before !seen
+SEEN_FLUSH_INTERVAL = 120000 # ms between writes of recently seen users to the database
+CACHE_SIZE = 256 # !seen results kept in memory
+CACHE_TTL = 300 # seconds before a cached !seen result is queried again
+TIME_COMMANDS = [] # extra (command, pytz zone, city) replies, e.g. ("!uktime", "Europe/London", "London")
 now_playing_source = 'FB2K'
-cooldown_time = Time.local_time()
-last_use = {}
-
-def flood_update(nick):
-    """ Update earliest time a new command can be called """
-    global cooldown_time
-    time_now = Time.local_time()
-    cooldown_time = time_now + datetime.timedelta(seconds=COOLDOWN_GENERAL)
-    last_use[nick] = time_now + datetime.timedelta(seconds=COOLDOWN_PER_USER)
+mod_index = Perm.ModIndex() # channel -> moderators, kept current by MODE/PART/JOIN hooks
+cooldowns = Cooldown.Cooldowns() # scope or (scope, nick), scope is a command of COMMAND_COOLDOWNS or None
+outbox = Send.Outbox() # rate limited replies, /ltb_outbox
+reply_priority = Send.NORMAL # lane of replies to the command being routed
 
 def on_global_cooldown():
     """ Return true if script has made a response recently """
-    time_now = Time.local_time()
-    if cooldown_time > time_now:
-        return True
-    else:
-        return False
-
-def on_cooldown(nick):
-    """ Return true if a command has been used too recently """
-    time_now = Time.local_time()
+    return not cooldowns.ready(None)
 
+def on_cooldown(nick, cmd=None, channel=None):
+    """ Return true if a command has been used too recently, otherwise start its cooldowns """
     if nick.lower() in ADMIN_ACCESS:
         return False
-    
-    if cooldown_time > time_now:
+    if MODS_SKIP_COOLDOWN and channel is not None and is_mod(nick, channel):
+        return False
+
+    scope = cmd if cmd in COMMAND_COOLDOWNS else None
+    general, per_user = COMMAND_COOLDOWNS.get(scope, (COOLDOWN_GENERAL, COOLDOWN_PER_USER))
+    time_now = Time.monotonic()
+    if not cooldowns.ready(scope, time_now):
         print "A command has been used too recently."
         return True
-    elif nick not in last_use:
-        flood_update(nick)
-        return False
-    elif last_use[nick] > time_now:
+    elif not cooldowns.ready((scope, nick), time_now):
         print nick + " has used a command too recently."
         return True
-    else:
-        flood_update(nick)
-        return False
+    cooldowns.start(scope, general, time_now)
+    cooldowns.start((scope, nick), per_user, time_now)
+    return False
 
 def break_nickname(nick):
     """ Insert zero-width spaces into name to avoid extra IRC highlights """
@@ -82,42 +93,183 @@ def break_nickname(nick):
     return new_nick
 
 def say(line):
-    """ Send message to current channel """
-    hexchat.command("say " + line)
+    """ Queue message for the current channel """
+    outbox.say(line, reply_priority)
+
+def say_if(line):
+    """ Send message unless there is nothing to say """
+    if line:
+        say(line)
 
 # database setup
+def seen_tables(db_cursor):
+    db_cursor.execute("CREATE TABLE IF NOT EXISTS seen (nick TEXT UNIQUE, message TEXT)") # before v1.4, read only
+    db_cursor.execute(("CREATE TABLE IF NOT EXISTS last_seen (nick TEXT, "
+                                                            "channel TEXT, "
+                                                            "time INTEGER, "
+                                                            "message TEXT, "
+                                                            "PRIMARY KEY(nick, channel))"))
+
+def seen_latest_index(db_cursor):
+    # !seen without a channel finds a nick's newest row without sorting all of them
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_SeenLatest ON last_seen(nick, time)")
+
+SEEN_MIGRATIONS = [(1, "tables", seen_tables),
+                   (2, "index for !seen", seen_latest_index)] # schema versions of seen.db
+
+def db_open():
+    """ Open seen.db, tuned and at the current schema """
+    connection = sqlite3.connect(db_path)
+    Migrate.tune(connection)
+    Migrate.migrate(connection, SEEN_MIGRATIONS, "seen.db")
+    return connection
+
 db_path = hexchat.get_info("configdir") + "/seen.db"
-db_connection = sqlite3.connect(db_path)
+db_connection = db_open()
 db_cursor = db_connection.cursor()
-db_cursor.execute("CREATE TABLE IF NOT EXISTS seen (nick TEXT UNIQUE, message TEXT)")
+ingest = None # Ingest.IngestWorker when THREADED_INGEST is on
+ingest_connection = None # owned by the ingest thread
+seen_cache = Cache.LRUCache(CACHE_SIZE, CACHE_TTL) # (channel or None, nick) -> database result or () if unknown
+profiler = Profile.Profiler(("filter", "parse", "seen", "persist", "flush", "commands", "is_mod", "twitch")) # /ltb_profile
+
+seen_records = {} # (channel, nick) -> Seen.SeenRecord of everyone seen since loading
+seen_latest = {} # nick -> channel the nick last talked in
+seen_dirty = set() # (channel, nick) of records not yet written to the database
+
+def seen_flush(connection):
+    """ Write records of recently seen users in one transaction """
+    global seen_dirty
+    start = profiler.start()
+    if seen_dirty:
+        dirty, seen_dirty = seen_dirty, set()
+        rows = []
+        for key in dirty:
+            record = seen_records[key]
+            rows.append((key[1], record.channel, record.time,
+                         record.message.decode('utf-8', 'replace')))
+        connection.executemany(u"REPLACE INTO last_seen (nick, channel, time, message) VALUES (?, ?, ?, ?)", rows)
+    connection.commit()
+    profiler.stop("flush", start)
 
 def db_commit(userdata):
-    db_connection.commit()
+    if ingest is not None:
+        ingest.call(ingest_commit)
+    else:
+        seen_flush(db_connection)
     return 1 # keep hook_timer running
 
 def db_unload(userdata):
-    db_connection.commit()
+    outbox.close()
+    Twitch.close()
+    if ingest is not None:
+        ingest.stop()
+    else:
+        seen_flush(db_connection)
     db_connection.close()
     hexchat.prnt(__module_name__ + " v" + __module_version__ + " has been unloaded.")
 
-def db_update(data):
-    """ Update the last time somebody was seen talking """
-    time_now = Time.local_time().strftime('%b %d, %Y at %H:%M %Z')
+def ingest_start():
+    """ Open the ingest thread's own connection, sqlite3 connections are per thread """
+    global ingest_connection
+    ingest_connection = db_open()
 
-    msg = u'This user was last seen saying \'{msg}\' on {date}'.format(msg=data['message'], 
-                                                                       date=time_now)
+def ingest_commit():
+    seen_flush(ingest_connection)
 
-    sql_query = u"REPLACE INTO seen (nick, message) VALUES (?, ?)"
-    db_cursor.execute(sql_query, (data['nick'], msg))
+def ingest_sync():
+    """ No-op, seen() waits for it to run so every line queued before is recorded """
 
-def seen(searcher, target):
-    """ Report the last time somebody was seen talking """
+def ingest_stop():
+    seen_flush(ingest_connection)
+    ingest_connection.close()
+
+def ingest_message(data):
+    """ Record a Bus.Message on the ingest thread """
+    start = profiler.start()
+    db_update(data)
+    profiler.stop("persist", start)
+
+def ingest_stats_cb(word, word_eol, userdata):
+    """ Print ingest queue counters """
+    if ingest is None:
+        print "Threaded ingest is off."
+    else:
+        print ("Ingest queue: {depth}/{maxsize} queued, {processed} processed, "
+               "{dropped} dropped, {errors} errors").format(**ingest.stats())
+    return hexchat.EAT_ALL
+
+def stats_cb(word, word_eol, userdata):
+    """ Print !seen result cache counters """
+    print "Seen cache: " + seen_cache.summary()
+    print "Moderators: {mods} known in {channels} channels".format(**mod_index.stats())
+    print "Cooldowns: {active}/{max_keys} active, {evicted} ended early to stay bounded".format(**cooldowns.stats())
+    return hexchat.EAT_ALL
+
+def profile_cb(word, word_eol, userdata):
+    """ Switch stage timing on or off, print or export it """
+    for line in profiler.command(word[1:]):
+        print line
+    return hexchat.EAT_ALL
+
+def outbox_stats_cb(word, word_eol, userdata):
+    """ Print outbound message counters """
+    print "Outbox: " + outbox.summary()
+    return hexchat.EAT_ALL
+
+def bookmark_stats_cb(word, word_eol, userdata):
+    """ Print !bookmark queue counters """
+    stats = Twitch.bookmark_stats()
+    if stats is None:
+        print "No bookmarks requested yet."
+    else:
+        print ("Bookmarks: {queued} queued, {submitted} submitted, {coalesced} coalesced, "
+               "{created} created, {failed} failed, latency {last_latency:.1f}s last "
+               "{avg_latency:.1f}s avg").format(**stats)
+    return hexchat.EAT_ALL
+
+def db_update(data):
+    """ Update the last time somebody was seen talking, data is a Bus.Message """
+    key = (data.channel, data.nick)
+    seen_records[key] = Seen.SeenRecord(int(time.time()), data.channel, data.message)
+    seen_latest[data.nick] = data.channel
+    seen_dirty.add(key)
+
+def seen(searcher, channel, target):
+    """ Report the last time somebody was seen talking, channel None looks in every channel """
     target_str = target.lower()
-    sql_query = "SELECT message FROM seen WHERE nick = ?"
-    db_cursor.execute(sql_query, (target_str,)) # need that comma to make 1-arg tuples
-    row = db_cursor.fetchone()
-    if row:
-        say("{0} -> {1}".format(searcher, row[0]))
+    synced = True
+    if ingest is not None:
+        # lines queued before the command may still be waiting on the ingest thread
+        synced = ingest.call(ingest_sync, wait=SYNC_TIMEOUT)
+    if channel is None:
+        record = seen_records.get((seen_latest.get(target_str), target_str))
+    else:
+        record = seen_records.get((channel, target_str))
+    if record is not None:
+        say("{0} -> {1}".format(searcher, record.render(channel is None)))
+        return
+
+    # not seen since loading, ask the database
+    row = seen_cache.get((channel, target_str))
+    if row is None:
+        if channel is None:
+            sql_query = "SELECT time, channel, message FROM last_seen WHERE nick = ? ORDER BY time DESC LIMIT 1"
+            db_cursor.execute(sql_query, (target_str,)) # need that comma to make 1-arg tuples
+        else:
+            sql_query = "SELECT time, channel, message FROM last_seen WHERE nick = ? AND channel = ?"
+            db_cursor.execute(sql_query, (target_str, channel))
+        row = db_cursor.fetchone()
+        if row is None:
+            sql_query = "SELECT message FROM seen WHERE nick = ?"
+            db_cursor.execute(sql_query, (target_str,))
+            row = db_cursor.fetchone() or ()
+        if row or synced:
+            seen_cache.put((channel, target_str), row) # a miss may only be ingest running behind
+
+    if len(row) == 3:
+        say("{0} -> {1}".format(searcher, Seen.SeenRecord(*row).render(channel is None)))
+    elif row:
+        say("{0} -> {1}".format(searcher, row[0])) # sentence stored before v1.4
     else:
         say("{0} -> Could not find records of {1}".format(searcher, target))
 
@@ -149,104 +301,110 @@ def set_now_playing_source(source):
         
     say("!sapmusic will now announce songs from {0}".format(source))
 
-def is_mod(nick):
-    mod_list = hexchat.get_list("users")
-    for i in mod_list:
-        if i.nick.lower() == nick.lower() and i.prefix == "@":
-            return True
-    return False
+def is_mod(nick, channel):
+    start = profiler.start()
+    found = mod_index.is_mod(channel, nick)
+    profiler.stop("is_mod", start)
+    return found
 
-def is_ignored(user):
-    ignore_list = hexchat.get_list("ignore")
-    for item in ignore_list:
-        if user in item.mask:
-            return True
-    return False
-
-def parse(word_eol):
-    str_data = word_eol[0].replace("!"," ", 1).split(None,4)    
-    data = {
-        "nick" : str_data[0].lstrip(":").lower().decode('ascii').encode('utf-8'),
-        "host" : str_data[1].decode('ascii').encode('utf-8'),
-        "type" : str_data[2].decode('ascii').encode('utf-8'),
-        "channel" : str_data[3].decode('ascii').encode('utf-8'),
-        "message" : str_data[4][1:].encode('utf-8')
-        }
-    return data
-
-def process(word, word_eol, userdata):
-    data = parse(word_eol)
-
-    if is_ignored(data['nick']):
-        return
-    db_update(data)
-    if data['nick'].lower() in ADMIN_ACCESS or not on_global_cooldown():
+def seen_cb(data):
+    """ Record every line, on the ingest thread when THREADED_INGEST is on """
+    if ingest is not None:
+        ingest.submit(data)
+    else:
+        db_update(data)
+
+def command_cb(data):
+    """ Answer commands, always on the HexChat thread as its API is not thread safe """
+    global reply_priority
+    admin = data.nick in ADMIN_ACCESS
+    if admin or not on_global_cooldown():
+        reply_priority = Send.ADMIN if admin else Send.NORMAL
         route(data)
+        reply_priority = Send.NORMAL
+
+def route_on_cooldown(command, data):
+    return on_cooldown(data.nick, command.name, data.channel)
+
+def route_is_mod(command, data):
+    return is_mod(data.nick, data.channel)
+
+def route_is_admin(command, data):
+    return data.nick.lower() in ADMIN_ACCESS
+
+router = Command.Router("!", route_on_cooldown, route_is_mod, route_is_admin)
 
 def route(data):
     """ Call commands if trigger present """
-    command_data = data['message'].split()
-    cmd = command_data[0].lower()
-    length = len(command_data)
-    
-    if cmd == '!ltb':
-        if not on_cooldown(data['nick']):
-            msg = "{0} -> Commands: !bookmark !viewers !seen !jptime !wctime !ectime".format(data['nick'])
+    router.dispatch(data)
+
+@router.command("!bookmark", cooldown=False)
+def bookmark_cmd(data, args):
+    if len(args) == 1:
+        # anyone gets the usage line, on the cooldowns of ordinary commands
+        if not on_cooldown(data.nick, None, data.channel):
+            msg = "{0} -> Usage: !bookmark TITLE | http://www.twitch.tv/low_tier_bot/profile/bookmarks".format(data.nick)
+            say(msg)
+    elif is_mod(data.nick, data.channel) and not route_on_cooldown(router.commands["!bookmark"], data):
+        Twitch.create_twitch_bookmark(data.channel, data.message, data.nick, PASS_FILE, say)
+
+@router.command("!viewers")
+def viewers_cmd(data, args):
+    # channel starts with hash
+    Twitch.run_async(profiler.wrap("twitch", Twitch.get_channel_views), (data.channel[1:], data.nick), say)
+
+@router.command("!seen")
+def seen_cmd(data, args):
+    length = len(args)
+    if length == 2 or (length == 3 and args[2].lower() == "all"):
+        if args[1].lower() in BOT_LIST:
+            msg = "{0} -> No messing with other bots.".format(data.nick)
             say(msg)
-                
-    if cmd == '!seen':
-        if on_cooldown(data['nick']):
             return
-        elif length == 2:
-            if command_data[1].lower() in BOT_LIST:
-                msg = "{0} -> No messing with other bots.".format(data['nick'])
-                say(msg)
-                return
-            seen(data['nick'], command_data[1])
-        else:
-            say("Usage: !seen NICKNAME")
-
-    if cmd == "!wctime":
-        if not on_cooldown(data['nick']):
-            say(Time.pacific_time())
-
-    if cmd == "!ectime":
-        if not on_cooldown(data['nick']):
-            say(Time.eastern_time())
-            
-    if cmd == '!jptime':
-        if not on_cooldown(data['nick']):
-            say(Time.japan_time())
-
-    if cmd == '!sapmusic':
-        if length == 2 and data['nick'] in ADMIN_ACCESS:
-            set_now_playing_source(command_data[1])
-        if not on_cooldown(data['nick']):
-            now_playing()
-            
-    if cmd == '!viewers':
-        if not on_cooldown(data['nick']):
-            # channel starts with hash
-            say(Twitch.get_channel_views(data['channel'][1:], data['nick']))
-
-    if cmd == "!status":
-        if not on_cooldown(data['nick']):
-            # channel starts with hash
-            response = Twitch.get_hosted_channel(data['channel'][1:], data['nick'])
-            if response:
-                say(response)
-
-    if cmd == "!bookmark":
-        if not on_cooldown(data['nick']):
-            if length == 1:
-                msg = "{0} -> Usage: !bookmark TITLE | http://www.twitch.tv/low_tier_bot/profile/bookmarks".format(data['nick'])
-                say(msg)
-            elif length > 1 and is_mod(data['nick']):
-                Twitch.create_twitch_bookmark(data['channel'], data['message'], data['nick'], PASS_FILE)
-            
-
+        channel = None if length == 3 else data.channel
+        seen(data.nick, channel, args[1])
+    else:
+        say("Usage: !seen NICKNAME [all]")
+
+@router.command("!ltb", listed=False)
+def ltb_cmd(data, args):
+    msg = "{0} -> Commands: {1}".format(data.nick, " ".join(router.listed()))
+    say(msg)
+
+@router.command("!status", listed=False)
+def status_cmd(data, args):
+    # channel starts with hash
+    Twitch.run_async(profiler.wrap("twitch", Twitch.get_hosted_channel), (data.channel[1:], data.nick), say_if)
+
+@router.command("!sapmusic", cooldown=False, listed=False)
+def sapmusic_cmd(data, args):
+    if len(args) == 2 and data.nick in ADMIN_ACCESS:
+        set_now_playing_source(args[1])
+    if not route_on_cooldown(router.commands["!sapmusic"], data):
+        now_playing()
+
+def time_cmd(data, args):
+    say(Time.zone_time(args[0].lower()))
+
+for command, zone_name, city in TIME_COMMANDS:
+    Time.register(command, zone_name, city)
+for command in Time.zone_commands:
+    router.add(command, time_cmd)
+
+if THREADED_INGEST:
+    ingest = Ingest.IngestWorker(ingest_message, INGEST_QUEUE_SIZE, INGEST_POLICY,
+                                 on_start=ingest_start, on_stop=ingest_stop, name="ltb_ingest")
+    ingest.start()
+
+mod_index.hook()
 hexchat.hook_unload(db_unload)
-hexchat.hook_server('PRIVMSG', process)
-hexchat.hook_timer(120000, db_commit)
+hexchat.hook_command("ltb_stats", stats_cb, help="/ltb_stats Shows hit, miss and eviction counts of the !seen result cache")
+hexchat.hook_command("ltb_bookmarks", bookmark_stats_cb, help="/ltb_bookmarks Shows queue and latency of !bookmark jobs")
+hexchat.hook_command("ltb_profile", profile_cb, help="/ltb_profile [on|off|reset|show|export PATH] Times filter, parse, seen, persist, flush, commands, is_mod and Twitch calls")
+hexchat.hook_command("ltb_outbox", outbox_stats_cb, help="/ltb_outbox Shows waiting, sent, merged and dropped replies")
+hexchat.hook_command("ltb_ingest", ingest_stats_cb, help="/ltb_ingest Shows queue depth and dropped messages of threaded ingest")
+Bus.subscribe("seen", seen_cb, Bus.ALL, profiler)
+Bus.subscribe("commands", command_cb, Bus.COMMANDS, profiler)
+hexchat.hook_timer(SEEN_FLUSH_INTERVAL, db_commit)
 
 hexchat.prnt(__module_name__ + " v" + __module_version__ + " has been loaded.")
\ No newline at end of file
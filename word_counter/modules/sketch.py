@@ -0,0 +1,172 @@
+""" Fixed memory approximate counting.
+
+A Count-Min Sketch estimates the count of any key in width * depth
+counters. An estimate is never below the true count and, with probability
+1 - e^-depth, at most e / width * total above it. A Space-Saving list keeps
+the keys with the highest estimates so they can be listed.
+"""
+
+from array import array
+import heapq
+import math
+import zlib
+
+def key_bytes(key):
+    """ Bytes to hash for a key, tuples are joined with NUL """
+    if isinstance(key, tuple):
+        return "\0".join(key_bytes(part) for part in key)
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return key
+
+def error_bound(width, depth, total):
+    """ (over count, probability) of a width x depth sketch that counted total, e.g. a saved one """
+    return int(math.ceil(math.e / width * total)), 1 - math.exp(-depth)
+
+class CountMinSketch(object):
+    """ Count-Min Sketch with conservative update """
+
+    def __init__(self, width=65536, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('l', [0]) * width for i in range(depth)]
+        self.total = 0
+
+    def indexes(self, key):
+        # double hashing, h1 + i * h2 stands in for depth independent hashes
+        data = key_bytes(key)
+        h1 = zlib.crc32(data) & 0xffffffff
+        h2 = zlib.adler32(data) & 0xffffffff | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """ Add count to key and return its new estimate """
+        indexes = self.indexes(key)
+        rows = self.rows
+        estimate = min(rows[i][index] for i, index in enumerate(indexes)) + count
+        # only raise counters that are below the new estimate
+        for i, index in enumerate(indexes):
+            if rows[i][index] < estimate:
+                rows[i][index] = estimate
+        self.total += count
+        return estimate
+
+    def estimate(self, key):
+        rows = self.rows
+        return min(rows[i][index] for i, index in enumerate(self.indexes(key)))
+
+    def error_bound(self):
+        """ Return (over count, probability the over count holds) for any estimate """
+        return error_bound(self.width, self.depth, self.total)
+
+    def nbytes(self):
+        return sum(row.itemsize * len(row) for row in self.rows)
+
+    def dumps(self):
+        return "".join(row.tostring() for row in self.rows)
+
+    def loads(self, data, total):
+        """ Restore counters written by dumps() from a sketch of the same size """
+        size = self.rows[0].itemsize * self.width
+        if len(data) != size * self.depth:
+            return False
+        for i in range(self.depth):
+            row = array('l')
+            row.fromstring(data[i * size:(i + 1) * size])
+            self.rows[i] = row
+        self.total = total
+        return True
+
+class SpaceSaving(object):
+    """ The capacity keys with the highest counts.
+
+    A key that is not tracked takes the place of the smallest one and starts
+    from that count plus its own, an over estimate. If an estimate from
+    elsewhere (e.g. a Count-Min Sketch) is given the lower of the two is kept,
+    and a key whose estimate cannot beat the smallest one is not tracked.
+    """
+
+    def __init__(self, capacity=2000):
+        self.capacity = capacity
+        self.counts = {} # key -> count
+        self.heap = [] # (count, key), entries go stale when a count changes
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def get(self, key):
+        return self.counts.get(key)
+
+    def set(self, key, count):
+        self.counts[key] = count
+        heapq.heappush(self.heap, (count, key))
+        if len(self.heap) > 4 * self.capacity + 64:
+            self.heap = [(count, key) for key, count in self.counts.iteritems()]
+            heapq.heapify(self.heap)
+
+    def smallest(self):
+        """ Return (count, key) of the smallest tracked key """
+        heap = self.heap
+        while heap[0][0] != self.counts.get(heap[0][1]):
+            heapq.heappop(heap)
+        return heap[0]
+
+    def offer(self, key, count, estimate=None):
+        """ Add count to key, return (tracked, evicted key or None) """
+        current = self.counts.get(key)
+        if current is not None:
+            current += count
+            if estimate is not None and estimate < current:
+                current = estimate
+            self.set(key, current)
+            return True, None
+        if len(self.counts) < self.capacity:
+            self.set(key, count if estimate is None else estimate)
+            return True, None
+
+        floor, evicted = self.smallest()
+        if estimate is not None and estimate <= floor:
+            return False, None
+        current = floor + count
+        if estimate is not None and estimate < current:
+            current = estimate
+        del self.counts[evicted]
+        self.set(key, current)
+        return True, evicted
+
+    def discard(self, key):
+        self.counts.pop(key, None)
+
+    def top(self, n):
+        return heapq.nlargest(n, self.counts.iteritems(), key=lambda item: item[1])
+
+class ApproximateCounter(object):
+    """ Count-Min Sketch of every key plus the Space-Saving list of the top ones """
+
+    def __init__(self, width=65536, depth=4, capacity=2000):
+        self.sketch = CountMinSketch(width, depth)
+        self.hitters = SpaceSaving(capacity)
+
+    def add(self, key, count=1):
+        """ Return (estimate, tracked, evicted key or None) """
+        estimate = self.sketch.add(key, count)
+        tracked, evicted = self.hitters.offer(key, count, estimate)
+        return estimate, tracked, evicted
+
+def create_tables(db_cursor):
+    db_cursor.execute("CREATE TABLE IF NOT EXISTS Sketch (name TEXT PRIMARY KEY, total INTEGER, data BLOB)")
+
+def save(db_cursor, name, sketch):
+    db_cursor.execute("REPLACE INTO Sketch (name, total, data) VALUES (?, ?, ?)",
+                      (name, sketch.total, buffer(sketch.dumps())))
+
+def load(db_cursor, name, sketch):
+    """ Restore a saved sketch, return False if there is none of this size """
+    db_cursor.execute("SELECT total, data FROM Sketch WHERE name=?", (name,))
+    row = db_cursor.fetchone()
+    if row is None:
+        return False
+    return sketch.loads(str(row[1]), row[0])
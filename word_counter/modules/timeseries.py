@@ -0,0 +1,119 @@
+""" Word counts over time.
+
+New counts go into hourly buckets, which are compacted into daily buckets
+once they are COMPACT_AFTER old and deleted after the retention period.
+Rolling windows ("day" = last 24 hours, "week" = last 7 days) are kept as
+running totals: counts are added as they are written and a bucket's counts
+are taken back out once it falls out of the window, so window queries never
+scan buckets. Buckets leave a window by their start, so once compacted to a
+day the "week" window covers the last 6 to 7 days.
+"""
+
+from collections import Counter
+
+import wordstore as Store
+
+HOUR = 3600
+DAY = 24 * HOUR
+WINDOWS = (("day", DAY), ("week", 7 * DAY))
+COMPACT_AFTER = 2 * DAY # must be longer than every window using hourly buckets
+RETENTION = 30 * DAY # buckets older than this are deleted
+
+def create_tables(db_cursor):
+    db_cursor.execute(("CREATE TABLE IF NOT EXISTS WordBuckets (start INTEGER, "
+                                                               "span INTEGER, "
+                                                               "user TEXT, "
+                                                               "word TEXT, "
+                                                               "count INTEGER, "
+                                                               "PRIMARY KEY(start, span, user, word))"))
+    db_cursor.execute(("CREATE TABLE IF NOT EXISTS WindowCount (window TEXT, "
+                                                               "user TEXT, "
+                                                               "word TEXT, "
+                                                               "count INTEGER, "
+                                                               "PRIMARY KEY(window, user, word))"))
+    db_cursor.execute(("CREATE TABLE IF NOT EXISTS WindowWords (window TEXT, "
+                                                               "word TEXT, "
+                                                               "count INTEGER, "
+                                                               "PRIMARY KEY(window, word))"))
+    # window -> start of the oldest bucket not yet taken out of it
+    db_cursor.execute("CREATE TABLE IF NOT EXISTS WindowState (window TEXT PRIMARY KEY, expired_until INTEGER)")
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_WindowWord ON WindowCount(window, word, count)")
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_WindowTop ON WindowWords(window, count)")
+
+def upsert(db_cursor, table, keys, rows):
+    """ Add counts to table, rows are key values followed by the count """
+    columns = ", ".join(keys + ("count",))
+    marks = ", ".join("?" * (len(keys) + 1))
+    if Store.HAS_UPSERT:
+        db_cursor.executemany(u"INSERT INTO {0} ({1}) VALUES ({2}) "
+                              "ON CONFLICT({3}) DO UPDATE SET count = count + excluded.count".format(
+                                  table, columns, marks, ", ".join(keys)), rows)
+    else:
+        match = " AND ".join("{0}=?".format(key) for key in keys)
+        db_cursor.executemany(u"UPDATE {0} SET count = count + ? WHERE {1}".format(table, match),
+                              [row[-1:] + row[:-1] for row in rows])
+        db_cursor.executemany(u"INSERT OR IGNORE INTO {0} ({1}) VALUES ({2})".format(table, columns, marks), rows)
+
+def add_counts(db_cursor, counts, totals, now):
+    """ Add a batch of {(user, word): count} with its per word totals to the current hour """
+    start = now - now % HOUR
+    upsert(db_cursor, "WordBuckets", ("start", "span", "user", "word"),
+           [(start, HOUR, user, word, count) for (user, word), count in counts.iteritems()])
+    for window, length in WINDOWS:
+        upsert(db_cursor, "WindowCount", ("window", "user", "word"),
+               [(window, user, word, count) for (user, word), count in counts.iteritems()])
+        upsert(db_cursor, "WindowWords", ("window", "word"),
+               [(window, word, count) for word, count in totals.iteritems()])
+
+def expired_until(db_cursor, window):
+    """ Start of the oldest bucket not yet taken out of window """
+    db_cursor.execute("SELECT expired_until FROM WindowState WHERE window=?", (window,))
+    row = db_cursor.fetchone()
+    return row[0] if row else 0
+
+def take_out(db_cursor, window, rows):
+    """ Subtract (user, word, count) rows from a window's totals """
+    counts = Counter()
+    window_rows = []
+    for user, word, count in rows:
+        window_rows.append((window, user, word, -count))
+        counts[word] -= count
+    if window_rows:
+        upsert(db_cursor, "WindowCount", ("window", "user", "word"), window_rows)
+        upsert(db_cursor, "WindowWords", ("window", "word"),
+               [(window, word, count) for word, count in counts.iteritems()])
+        db_cursor.execute("DELETE FROM WindowCount WHERE window=? AND count <= 0", (window,))
+        db_cursor.execute("DELETE FROM WindowWords WHERE window=? AND count <= 0", (window,))
+
+def expire(db_cursor, now):
+    """ Take buckets that fell out of each window back out of its totals """
+    for window, length in WINDOWS:
+        cutoff = now - length
+        db_cursor.execute(("SELECT user, word, SUM(count) FROM WordBuckets "
+                           "WHERE start >= ? AND start < ? GROUP BY user, word"),
+                          (expired_until(db_cursor, window), cutoff))
+        take_out(db_cursor, window, db_cursor.fetchall())
+        db_cursor.execute("REPLACE INTO WindowState (window, expired_until) VALUES (?, ?)", (window, cutoff))
+
+def compact(db_cursor, now):
+    """ Merge hourly buckets older than COMPACT_AFTER into daily ones, then apply retention """
+    cutoff = now - COMPACT_AFTER
+    # an hour still in a window whose day starts before the window's expired_until
+    # would never be expired once merged (e.g. after downtime), take it out up to a day early
+    for window, length in WINDOWS:
+        until = expired_until(db_cursor, window)
+        db_cursor.execute(("SELECT user, word, SUM(count) FROM WordBuckets "
+                           "WHERE span = ? AND start < ? AND start >= ? AND start - start % ? < ? "
+                           "GROUP BY user, word"), (HOUR, cutoff, until, DAY, until))
+        take_out(db_cursor, window, db_cursor.fetchall())
+    db_cursor.execute(("SELECT start - start % ?, user, word, SUM(count) FROM WordBuckets "
+                       "WHERE span = ? AND start < ? GROUP BY 1, user, word"), (DAY, HOUR, cutoff))
+    rows = [(start, DAY, user, word, count) for start, user, word, count in db_cursor.fetchall()]
+    db_cursor.execute("DELETE FROM WordBuckets WHERE span = ? AND start < ?", (HOUR, cutoff))
+    upsert(db_cursor, "WordBuckets", ("start", "span", "user", "word"), rows)
+    db_cursor.execute("DELETE FROM WordBuckets WHERE start < ?", (now - RETENTION,))
+
+def maintain(db_cursor, now):
+    """ Expire windows then compact, in this order so compacted buckets are never expired twice """
+    expire(db_cursor, now)
+    compact(db_cursor, now)
@@ -0,0 +1,98 @@
+import os
+import re
+from collections import Counter
+
+URL_RE = re.compile(r'https?:\/\/') # everything from a URL to the end of the line is dropped
+# one alternation so the rest is scanned once: chat commands are consumed
+# and skipped, runs of letters are words
+TOKEN_RE = re.compile(r'(?P<cmd>\!\w+\s)|(?P<word>[^\W\d_]+)')
+SKIP_PREFIXES = ("!", "http")
+
+class StopWords(object):
+    """ Stop words compiled into a frozenset and a tuple of prefix rules.
+
+    The file holds words separated by commas or whitespace, a word ending
+    in "*" is a prefix rule ("lol*" also stops "lolol"). reload_if_changed()
+    reads the file again when its mtime changes. rules is rebound in one
+    step, so other threads can keep matching while it reloads.
+    """
+
+    def __init__(self, path=None, prefixes=SKIP_PREFIXES):
+        self.path = path
+        self.default_prefixes = tuple(prefixes)
+        self.rules = (frozenset(), self.default_prefixes) # (words, prefixes)
+        self.mtime = None
+        if path is not None:
+            self.reload_if_changed()
+
+    def __contains__(self, word):
+        words, prefixes = self.rules
+        return word in words or word.startswith(prefixes)
+
+    def __len__(self):
+        return len(self.rules[0])
+
+    def reload_if_changed(self):
+        """ Load the file if it changed since the last load, return True if it was loaded """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None # missing file, no stop words
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        self.rules = self.compile(self.read() if mtime is not None else u"")
+        return True
+
+    def read(self):
+        with open(self.path, 'rb') as file:
+            return file.read().decode('utf-8-sig', 'replace')
+
+    def compile(self, text):
+        # words are separated by commas or whitespace, str.split() is much faster than csv or re
+        words = set(text.lower().replace(u",", u" ").replace(u'"', u" ").split())
+        prefixes = set(word for word in words if word.endswith(u"*"))
+        words -= prefixes
+        return frozenset(words), self.default_prefixes + tuple(prefix[:-1] for prefix in prefixes if prefix != u"*")
+
+    def summary(self):
+        words, prefixes = self.rules
+        return "{0} stop words, {1} prefix rules".format(len(words), len(prefixes))
+
+NO_STOP_WORDS = StopWords()
+
+def count_words(message, stop_words=NO_STOP_WORDS, max_length=16, min_length=3, max_repeat=2):
+    """ Tokenize a chat message and decide which words are counted.
+
+    Returns a list of (word, count, reason) with words decoded to unicode
+    once. reason is None for words to count, otherwise "Spam" when a word
+    repeats more than max_repeat times or "Too long" past max_length.
+    Words in stop_words (a StopWords) and words shorter than min_length
+    are left out entirely.
+    """
+    if isinstance(message, str):
+        message = message.decode('utf-8', 'replace')
+
+    message = message.lower()
+    url = URL_RE.search(message)
+    if url:
+        message = message[:url.start()]
+
+    freq = Counter()
+    for match in TOKEN_RE.finditer(message):
+        word = match.group('word')
+        if word is not None and len(word) >= min_length:
+            freq[word] += 1
+
+    words, prefixes = stop_words.rules
+    results = []
+    for word, count in freq.iteritems():
+        if word in words or word.startswith(prefixes):
+            continue
+        elif count > max_repeat:
+            results.append((word, count, "Spam"))
+        elif len(word) > max_length:
+            results.append((word, count, "Too long"))
+        else:
+            results.append((word, count, None))
+    return results
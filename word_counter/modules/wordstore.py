@@ -0,0 +1,199 @@
+import sqlite3
+import threading
+from collections import Counter
+import heapq
+
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0) # INSERT ... ON CONFLICT DO UPDATE
+WITHOUT_ROWID = " WITHOUT ROWID" if sqlite3.sqlite_version_info >= (3, 8, 2) else ""
+MAX_INTERNED = 500000 # ids cached per Vocabulary table before the cache starts over
+CHUNK = 500 # parameters per IN (...) query, sqlite allows 999
+
+class ConnectionPool(object):
+    """ sqlite3 connections by database path, opened on first use.
+
+    Each thread gets its own set because a sqlite3 connection can only be
+    used by the thread that opened it. setup(connection, path) runs on new
+    connections.
+    """
+
+    def __init__(self, setup=None):
+        self.setup = setup
+        self.local = threading.local()
+
+    def get(self, path):
+        connections = self.local.__dict__.setdefault("connections", {})
+        connection = connections.get(path)
+        if connection is None:
+            connection = sqlite3.connect(path)
+            if self.setup:
+                self.setup(connection, path)
+                connection.commit()
+            connections[path] = connection
+        return connection
+
+    def close_thread(self):
+        """ Commit and close the calling thread's connections """
+        for connection in self.local.__dict__.pop("connections", {}).values():
+            connection.commit()
+            connection.close()
+
+class Vocabulary(object):
+    """ Ids of one database's Users and Words rows, cached by text.
+
+    Ids are never deleted or reused, so cached ids stay valid for as long
+    as the database exists. Only writers need one, queries join the tables.
+    """
+
+    def __init__(self, max_size=MAX_INTERNED):
+        self.max_size = max_size
+        self.users = {} # nick -> Users.id
+        self.words = {} # text -> Words.id
+
+    def user_ids(self, db_cursor, nicks):
+        return self.intern(db_cursor, self.users, "Users", "nick", nicks)
+
+    def word_ids(self, db_cursor, words):
+        return self.intern(db_cursor, self.words, "Words", "text", words)
+
+    def intern(self, db_cursor, cache, table, column, texts):
+        """ Return cache with an id for each of texts, adding the new ones to table """
+        missing = [text for text in texts if text not in cache]
+        if not missing:
+            return cache
+        if len(cache) + len(missing) > self.max_size:
+            cache.clear()
+            missing = list(texts)
+        db_cursor.executemany("INSERT OR IGNORE INTO {0} ({1}) VALUES (?)".format(table, column),
+                              [(text,) for text in missing])
+        for i in range(0, len(missing), CHUNK):
+            chunk = missing[i:i + CHUNK]
+            db_cursor.execute("SELECT {1}, id FROM {0} WHERE {1} IN ({2})".format(
+                table, column, ",".join("?" * len(chunk))), chunk)
+            cache.update(db_cursor.fetchall()) # unicode keys, equal to the ASCII str nicks are given as
+        return cache
+
+def migrate_v1(db_cursor):
+    """ Tables as created before schema versions """
+    db_cursor.execute(("CREATE TABLE IF NOT EXISTS WordCount (user TEXT, "
+                                                             "word TEXT, "
+                                                             "count INTEGER, "
+                                                             "UNIQUE(user, word) ON CONFLICT REPLACE)"))
+    db_cursor.execute(("CREATE TABLE IF NOT EXISTS EveryUser (word TEXT UNIQUE, count INTEGER)"))
+
+def migrate_v2(db_cursor):
+    db_cursor.execute("DROP INDEX IF EXISTS idx_UserTop") # (user, word), a copy of the UNIQUE constraint's index
+    db_cursor.execute("DROP INDEX IF EXISTS idx_WordTop") # (word, count), !words <word> still had to look up each user
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_UserWords ON WordCount(user, count, word)")
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_WordUsers ON WordCount(word, count, user)")
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_EveryTop ON EveryUser(count, word)")
+
+def migrate_v3(db_cursor):
+    """ Move nicks and words into Users and Words, WordCount keeps their ids """
+    db_cursor.execute("CREATE TABLE Users (id INTEGER PRIMARY KEY, nick TEXT UNIQUE)")
+    db_cursor.execute("CREATE TABLE Words (id INTEGER PRIMARY KEY, text TEXT UNIQUE)")
+    db_cursor.execute("INSERT INTO Users (nick) SELECT DISTINCT user FROM WordCount ORDER BY user")
+    db_cursor.execute("INSERT INTO Words (text) SELECT DISTINCT word FROM WordCount ORDER BY word")
+    create_count_table(db_cursor, "WordCountIds")
+    db_cursor.execute(("INSERT INTO WordCountIds (user_id, word_id, count) "
+                       "SELECT Users.id, Words.id, WordCount.count FROM WordCount "
+                       "JOIN Users ON Users.nick = WordCount.user "
+                       "JOIN Words ON Words.text = WordCount.word "
+                       "ORDER BY Users.id, Words.id"))
+    db_cursor.execute("DROP TABLE WordCount")
+    db_cursor.execute("ALTER TABLE WordCountIds RENAME TO WordCount")
+    create_indexes(db_cursor)
+    # the (user, word, count) rows of before, for reading
+    db_cursor.execute(("CREATE VIEW UserWords AS "
+                       "SELECT Users.nick AS user, Words.text AS word, WordCount.count AS count FROM WordCount "
+                       "JOIN Users ON Users.id = WordCount.user_id "
+                       "JOIN Words ON Words.id = WordCount.word_id"))
+
+# schema versions for migratemod.migrate(), steps must not change once released
+MIGRATIONS = [(1, "tables", migrate_v1),
+              (2, "covering indexes for top-N queries", migrate_v2),
+              (3, "interned users and words", migrate_v3)]
+
+def create_count_table(db_cursor, name):
+    db_cursor.execute(("CREATE TABLE {0} (user_id INTEGER, "
+                                         "word_id INTEGER, "
+                                         "count INTEGER, "
+                                         "PRIMARY KEY(user_id, word_id)){1}").format(name, WITHOUT_ROWID))
+
+def create_indexes(db_cursor):
+    """ Covering indexes, the top-N queries read them in count order without touching the tables.
+    Index rows also hold the primary key, so (user_id, count) covers word_id too. """
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_UserWords ON WordCount(user_id, count)")
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_WordUsers ON WordCount(word_id, count)")
+    db_cursor.execute("CREATE INDEX IF NOT EXISTS idx_EveryTop ON EveryUser(count, word)")
+
+def drop_indexes(db_cursor):
+    """ Drop secondary indexes before a bulk load, create_indexes() rebuilds them """
+    for index in ("idx_UserWords", "idx_WordUsers", "idx_EveryTop"):
+        db_cursor.execute("DROP INDEX IF EXISTS " + index)
+
+def pair_rows(db_cursor, vocabulary, counts):
+    """ [(user_id, word_id, count)] of {(user, word): count} """
+    user_ids = vocabulary.user_ids(db_cursor, set(user for user, word in counts))
+    word_ids = vocabulary.word_ids(db_cursor, set(word for user, word in counts))
+    return [(user_ids[user], word_ids[word], count) for (user, word), count in counts.iteritems()]
+
+def add_counts(db_cursor, vocabulary, counts):
+    """ Add a batch of {(user, word): count} to the WordCount and EveryUser tables,
+    return the per word totals of the batch """
+    user_rows = pair_rows(db_cursor, vocabulary, counts)
+    # different table for faster aggregate data
+    totals = Counter()
+    for (user, word), count in counts.iteritems():
+        totals[word] += count
+    word_rows = totals.items()
+
+    if HAS_UPSERT:
+        db_cursor.executemany(u"INSERT INTO WordCount (user_id, word_id, count) VALUES (?, ?, ?) "
+                              "ON CONFLICT(user_id, word_id) DO UPDATE SET count = count + excluded.count", user_rows)
+        db_cursor.executemany(u"INSERT INTO EveryUser (word, count) VALUES (?, ?) "
+                              "ON CONFLICT(word) DO UPDATE SET count = count + excluded.count", word_rows)
+    else:
+        # sqlite3 older than 3.24 has no UPSERT, bump existing rows then add the missing ones
+        db_cursor.executemany(u"UPDATE WordCount SET count = count + ? WHERE user_id=? AND word_id=?",
+                              [(count, user_id, word_id) for user_id, word_id, count in user_rows])
+        db_cursor.executemany(u"INSERT OR IGNORE INTO WordCount (user_id, word_id, count) VALUES (?, ?, ?)",
+                              user_rows)
+        db_cursor.executemany(u"UPDATE EveryUser SET count = count + ? WHERE word=?",
+                              [(count, word) for word, count in word_rows])
+        db_cursor.executemany(u"INSERT OR IGNORE INTO EveryUser (word, count) VALUES (?, ?)", word_rows)
+    return totals
+
+def set_counts(db_cursor, vocabulary, counts):
+    """ Overwrite the WordCount rows of {(user, word): count} """
+    db_cursor.executemany("REPLACE INTO WordCount (user_id, word_id, count) VALUES (?, ?, ?)",
+                          pair_rows(db_cursor, vocabulary, counts))
+
+def delete_pairs(db_cursor, vocabulary, pairs):
+    """ Delete the WordCount rows of (user, word) pairs """
+    rows = pair_rows(db_cursor, vocabulary, dict.fromkeys(pairs, 0))
+    db_cursor.executemany("DELETE FROM WordCount WHERE user_id=? AND word_id=?",
+                          [(user_id, word_id) for user_id, word_id, count in rows])
+
+def top_words(db_cursor, size):
+    """ {word: count} of the size most said words """
+    db_cursor.execute("SELECT word, count FROM EveryUser ORDER BY count DESC LIMIT ?", (size,))
+    return dict(db_cursor.fetchall())
+
+def merge_top_words(db_cursor, board, totals, size):
+    """ Return a new leaderboard of board with a written batch of {word: added count} merged in """
+    board = dict(board)
+    outside = []
+    for word, count in totals.iteritems():
+        if word in board:
+            board[word] += count
+        else:
+            outside.append(word)
+    # counts only ever grow, so a word can only join the board through this batch
+    for i in range(0, len(outside), CHUNK):
+        chunk = outside[i:i + CHUNK]
+        db_cursor.execute("SELECT word, count FROM EveryUser WHERE word IN ({0})".format(
+            ",".join("?" * len(chunk))), chunk)
+        board.update(db_cursor.fetchall())
+    if len(board) > size:
+        board = dict(heapq.nlargest(size, board.iteritems(), key=lambda item: item[1]))
+    return board # callers rebind it in one step, safe to read from another thread
@@ -0,0 +1,143 @@
+""" Compare the interned schema (v3) with the text schema (v2) it replaced.
+
+Usage: python wcBenchSchema.py [--messages N] [--chatters N] [--vocabulary N]
+
+Writes the synthetic chat of wcBenchUpsert.py to a v2 and a v3 database
+with the same batched write, then prints rows written per second, the
+size of each table and index, the file size after VACUUM and how long a
+!words user / word query takes on each. Also times migrating the v2
+database to v3.
+"""
+
+from collections import Counter
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'twitch_chat_bot', 'modules'))
+
+import migratemod as Migrate
+import wordstore as Store
+from wcBenchUpsert import batches
+
+QUERIES = 1000 # of each kind
+
+# the top-N queries of wordCounter.py for each schema
+V2_QUERIES = ("SELECT word, count FROM WordCount WHERE user=? ORDER BY count DESC LIMIT 8",
+              "SELECT user, count FROM WordCount WHERE word=? ORDER BY count DESC LIMIT 8")
+V3_QUERIES = (("SELECT Words.text, WordCount.count "
+               "FROM WordCount JOIN Words ON Words.id = WordCount.word_id "
+               "WHERE WordCount.user_id=(SELECT id FROM Users WHERE nick=?) "
+               "ORDER BY WordCount.count DESC LIMIT 8"),
+              ("SELECT Users.nick, WordCount.count "
+               "FROM WordCount JOIN Users ON Users.id = WordCount.user_id "
+               "WHERE WordCount.word_id=(SELECT id FROM Words WHERE text=?) "
+               "ORDER BY WordCount.count DESC LIMIT 8"))
+
+def v2_write(db_cursor, counts):
+    """ wc_update_sql on the text schema, the same statements add_counts runs on ids """
+    totals = Counter()
+    for (user, word), count in counts.iteritems():
+        totals[word] += count
+    user_rows = [(user, word, count) for (user, word), count in counts.iteritems()]
+    if Store.HAS_UPSERT:
+        db_cursor.executemany(u"INSERT INTO WordCount (user, word, count) VALUES (?, ?, ?) "
+                              "ON CONFLICT(user, word) DO UPDATE SET count = count + excluded.count", user_rows)
+        db_cursor.executemany(u"INSERT INTO EveryUser (word, count) VALUES (?, ?) "
+                              "ON CONFLICT(word) DO UPDATE SET count = count + excluded.count", totals.items())
+    else:
+        db_cursor.executemany(u"UPDATE WordCount SET count = count + ? WHERE user=? AND word=?",
+                              [(count, user, word) for user, word, count in user_rows])
+        db_cursor.executemany(u"INSERT OR IGNORE INTO WordCount (user, word, count) VALUES (?, ?, ?)", user_rows)
+        db_cursor.executemany(u"UPDATE EveryUser SET count = count + ? WHERE word=?",
+                              [(count, word) for word, count in totals.items()])
+        db_cursor.executemany(u"INSERT OR IGNORE INTO EveryUser (word, count) VALUES (?, ?)", totals.items())
+
+def v3_writer():
+    vocabulary = Store.Vocabulary()
+    return lambda db_cursor, counts: Store.add_counts(db_cursor, vocabulary, counts)
+
+def build(path, migrations, write, args):
+    """ Write the corpus to a new database, return rows/s """
+    connection = sqlite3.connect(path)
+    Migrate.tune(connection)
+    Migrate.migrate(connection, migrations)
+    cursor = connection.cursor()
+    rows = 0
+    elapsed = 0.0
+    for counts in batches(args.messages, args.chatters, args.vocabulary):
+        start = time.time()
+        write(cursor, counts)
+        connection.commit()
+        elapsed += time.time() - start
+        rows += len(counts)
+    connection.execute("VACUUM")
+    connection.close()
+    return rows / elapsed
+
+def sizes(path):
+    """ {table or index: bytes} and the file size """
+    connection = sqlite3.connect(path)
+    try:
+        pages = dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    except sqlite3.OperationalError:
+        pages = {} # sqlite built without SQLITE_ENABLE_DBSTAT_VTAB
+    connection.close()
+    return pages, os.path.getsize(path)
+
+def query_ms(path, queries, users, words):
+    """ Milliseconds per !words user and !words word query """
+    connection = sqlite3.connect(path)
+    times = []
+    for query, keys in zip(queries, (users, words)):
+        start = time.time()
+        for i in range(QUERIES):
+            connection.execute(query, (keys[i % len(keys)],)).fetchall()
+        times.append((time.time() - start) * 1000 / QUERIES)
+    connection.close()
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the interned word counter schema against the text one")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chatters", type=int, default=20000)
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words")
+    args = parser.parse_args()
+
+    # the busiest 100 of each, batches() draws low numbers most often
+    users = [u"chatter{0}".format(i) for i in range(1, 101)]
+    words = [u"word{0}".format(i) for i in range(1, 101)]
+    directory = tempfile.mkdtemp()
+    try:
+        v2_path = os.path.join(directory, "v2.db")
+        v3_path = os.path.join(directory, "v3.db")
+        print "{0:,} messages, sqlite {1}".format(args.messages, sqlite3.sqlite_version)
+        for label, path, migrations, write, queries in (
+                ("v2 text", v2_path, Store.MIGRATIONS[:2], v2_write, V2_QUERIES),
+                ("v3 ids", v3_path, Store.MIGRATIONS, v3_writer(), V3_QUERIES)):
+            rate = build(path, migrations, write, args)
+            pages, size = sizes(path)
+            user_ms, word_ms = query_ms(path, queries, users, words)
+            print "{0}: {1:,.0f} rows/s, {2:,} KB, !words user {3:.3f} ms, !words word {4:.3f} ms".format(
+                label, rate, size / 1024, user_ms, word_ms)
+            for name, nbytes in sorted(pages.iteritems(), key=lambda item: -item[1]):
+                if nbytes >= 64 * 1024:
+                    print "    {0:<28} {1:>9,} KB".format(name, nbytes / 1024)
+
+        connection = sqlite3.connect(v2_path)
+        start = time.time()
+        Migrate.migrate(connection, Store.MIGRATIONS)
+        migrated = time.time() - start
+        connection.execute("VACUUM")
+        connection.close()
+        print "v2 -> v3 migration: {0:.1f}s, {1:,} KB after VACUUM".format(migrated, os.path.getsize(v2_path) / 1024)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
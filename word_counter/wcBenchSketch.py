@@ -0,0 +1,121 @@
+""" Compare APPROXIMATE mode's memory and accuracy with the exact tables.
+
+Usage: python wcBenchSketch.py [--messages N] [--width N] [--depth N]
+
+Counts the synthetic chat of wcBenchUpsert.py exactly and through the
+pairs and words ApproximateCounters, writes both to databases the way
+wc_flush does and prints their sizes, how far the estimates of the !words
+answers are off and whether the top lists match.
+"""
+
+from collections import Counter
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'twitch_chat_bot', 'modules'))
+
+import migratemod as Migrate
+import sketch as Sketch
+import wordstore as Store
+from wcBenchUpsert import batches
+
+# keep in sync with wordCounter.py
+TOP_WORDS = 10
+TOP_USERS = 8 # LIMIT of !words user and !words word
+HEAVY_PAIRS = 20000
+HEAVY_WORDS = 2000
+
+def database(path, pairs, words, sketches=()):
+    """ Write {(user, word): count} and {word: count} to a new database, return its size in bytes """
+    connection = sqlite3.connect(path)
+    Migrate.migrate(connection, Store.MIGRATIONS)
+    cursor = connection.cursor()
+    Store.set_counts(cursor, Store.Vocabulary(), pairs)
+    cursor.executemany("INSERT INTO EveryUser (word, count) VALUES (?, ?)", words.iteritems())
+    if sketches:
+        Sketch.create_tables(cursor)
+        for name, sketch in sketches:
+            Sketch.save(cursor, name, sketch)
+    connection.commit()
+    connection.execute("VACUUM")
+    connection.close()
+    return os.path.getsize(path)
+
+def errors(exact, estimate, keys):
+    """ (mean, max) over count of estimate(key) for keys """
+    over = [estimate(key) - exact[key] for key in keys]
+    return float(sum(over)) / len(over), max(over)
+
+def top(counts, n, keep=lambda key: True):
+    """ The n keys with the highest counts, ties by key """
+    items = [(key, count) for key, count in counts.iteritems() if keep(key)]
+    return [key for key, count in sorted(items, key=lambda item: (-item[1], item[0]))[:n]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark approximate word counting against exact counts")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chatters", type=int, default=20000)
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words")
+    parser.add_argument("--width", type=int, default=65536, help="SKETCH_WIDTH")
+    parser.add_argument("--depth", type=int, default=4, help="SKETCH_DEPTH")
+    args = parser.parse_args()
+
+    exact_pairs = Counter()
+    exact_words = Counter()
+    pairs = Sketch.ApproximateCounter(args.width, args.depth, HEAVY_PAIRS)
+    words = Sketch.ApproximateCounter(args.width, args.depth, HEAVY_WORDS)
+    for counts in batches(args.messages, args.chatters, args.vocabulary):
+        totals = Counter()
+        for (user, word), count in counts.iteritems():
+            totals[word] += count
+        exact_pairs.update(counts)
+        exact_words.update(totals)
+        for key, count in counts.iteritems():
+            pairs.add(key, count)
+        for key, count in totals.iteritems():
+            words.add(key, count)
+
+    directory = tempfile.mkdtemp()
+    try:
+        exact_size = database(os.path.join(directory, "exact.db"), exact_pairs, exact_words)
+        approx_size = database(os.path.join(directory, "approx.db"), pairs.hitters.counts, words.hitters.counts,
+                               [("pairs", pairs.sketch), ("words", words.sketch)])
+    finally:
+        shutil.rmtree(directory)
+
+    over, probability = pairs.sketch.error_bound()
+    print "{0:,} messages, {1:,} words counted, {2:,} pairs, {3:,} distinct words".format(
+        args.messages, pairs.sketch.total, len(exact_pairs), len(exact_words))
+    print "exact:       {0:>9,} KB database, {1:,} pair rows".format(exact_size / 1024, len(exact_pairs))
+    print "approximate: {0:>9,} KB database, {1:,} pair rows, {2:,} KB of sketches in memory".format(
+        approx_size / 1024, len(pairs.hitters), (pairs.sketch.nbytes() + words.sketch.nbytes()) / 1024)
+    print "bound: at most {0:,} too high, {1:.0%} sure".format(over, probability)
+
+    pair_errors = errors(exact_pairs, pairs.sketch.estimate, exact_pairs)
+    word_errors = errors(exact_words, words.sketch.estimate, exact_words)
+    beyond = sum(1 for key in exact_pairs if pairs.sketch.estimate(key) - exact_pairs[key] > over)
+    print "every pair:  {0:.2f} mean, {1:,} max too high, {2:,} beyond the bound".format(
+        pair_errors[0], pair_errors[1], beyond)
+    print "every word:  {0:.2f} mean, {1:,} max too high".format(*word_errors)
+
+    # the answers !words gives: the everyone board and the top lists of the busiest users and words
+    board_matches = top(exact_words, TOP_WORDS) == [key for key, count in words.hitters.top(TOP_WORDS)]
+    print "!words everyone: {0}".format("same top {0}".format(TOP_WORDS) if board_matches else "differs")
+    user_totals = Counter()
+    for (user, word), count in exact_pairs.iteritems():
+        user_totals[user] += count
+    for kind, keys, side in (("user", top(user_totals, TOP_USERS), 0), ("word", top(exact_words, TOP_USERS), 1)):
+        same = 0
+        for key in keys:
+            in_key = lambda pair, key=key: pair[side] == key
+            same += top(exact_pairs, TOP_USERS, in_key) == top(pairs.hitters.counts, TOP_USERS, in_key)
+        print "!words {0}: {1} of the {2} busiest answered with the exact top {3}".format(
+            kind, same, len(keys), TOP_USERS)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+""" Compare the tokenizer with the multi-pass wc_update code it replaced.
+
+Usage: python wcBenchTokenizer.py stop_words.csv LOGFILE [LOGFILE ...] [--repeat N]
+
+Reads chat lines the same way as wcImport.py, checks that both paths count
+the same words and prints messages per second for each.
+"""
+
+from collections import Counter
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'twitch_chat_bot', 'modules'))
+
+import tokenizer as Tokenizer
+from wcImport import MAX_CHAR_LENGTH, parse_messages, read_lines
+
+# wc_update before the tokenizer module
+UNI_RE = re.compile(r'[^\W\d_]+') # match groups of unicode letters
+HTTP_RE = re.compile(r'https?:\/\/.*[\r\n]*') # re.sub() remove URLs
+CMD_RE = re.compile(r'\!\w+\s') # remove other chat commands
+
+def old_count_words(message, stop_words):
+    """ stop_words is a set of utf-8 str, as load_stop_words returned """
+    msg_no_cmds = CMD_RE.sub(' ', message.lower())
+    msg_no_urls = HTTP_RE.sub('', msg_no_cmds)
+    result = filter(lambda x: len(x.decode('utf-8')) > 2, UNI_RE.findall(msg_no_urls))
+    freq = Counter(result)
+    results = []
+    for word in freq:
+        if word in stop_words or word.startswith("!") or word.startswith("http"):
+            continue
+        elif freq[word] > 2:
+            results.append((word.decode('utf-8'), freq[word], "Spam"))
+        elif len(word.decode('utf-8')) > MAX_CHAR_LENGTH:
+            results.append((word.decode('utf-8'), freq[word], "Too long"))
+        elif word != " ":
+            results.append((word.decode('utf-8'), freq[word], None))
+    return results
+
+def new_count_words(message, stop_words):
+    return Tokenizer.count_words(message, stop_words, MAX_CHAR_LENGTH)
+
+def best_rate(count_words, messages, stop_words, repeat):
+    """ Messages per second of the fastest of repeat runs """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for message in messages:
+            count_words(message, stop_words)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(messages) / best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the word counter tokenizer on chat logs")
+    parser.add_argument("stop_words")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path, the fastest is reported")
+    args = parser.parse_args()
+
+    stop_words = Tokenizer.StopWords(args.stop_words)
+    messages = [message for path in args.logs for nick, message in parse_messages(read_lines(path))]
+    if not messages:
+        print "No chat lines found"
+        sys.exit(1)
+
+    old_stop_words = set(word.encode('utf-8') for word in stop_words.rules[0])
+    mismatches = sum(1 for message in messages
+                     if sorted(old_count_words(message, old_stop_words)) != sorted(new_count_words(message, stop_words)))
+    print "{0} messages, {1} counted differently".format(len(messages), mismatches)
+
+    old_rate = best_rate(old_count_words, messages, old_stop_words, args.repeat)
+    new_rate = best_rate(new_count_words, messages, stop_words, args.repeat)
+    print "multi-pass: {0:,.0f} messages/s".format(old_rate)
+    print "tokenizer:  {0:,.0f} messages/s ({1:.2f}x)".format(new_rate, new_rate / old_rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+""" Compare the in-memory !words everyone leaderboard with querying EveryUser.
+
+Usage: python wcBenchTopWords.py [--rows N [N ...]] [--queries N]
+
+Builds a scratch EveryUser table per row count, then times the SQL query
+without an index on count (before schema v2), with idx_EveryTop, and the
+leaderboard: answering from memory and merging one flushed batch.
+"""
+
+from collections import Counter
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+
+import wordstore as Store
+
+TOP_WORDS = 10 # keep in sync with wordCounter.py
+BATCH_WORDS = 300 # distinct words in one flushed batch, about a FLUSH_THRESHOLD of 500 pairs
+TOP_QUERY = "SELECT word, count FROM EveryUser ORDER BY count DESC LIMIT ?"
+
+def build(path, rows):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE EveryUser (word TEXT UNIQUE, count INTEGER)")
+    rand = random.Random(rows)
+    connection.executemany("INSERT INTO EveryUser (word, count) VALUES (?, ?)",
+                           ((u"w{0}".format(i), int(1000000 / (i + 1)) + rand.randint(0, 9)) for i in xrange(rows)))
+    connection.commit()
+    return connection
+
+def per_call(func, calls):
+    """ Milliseconds per call """
+    start = time.time()
+    for i in range(calls):
+        func()
+    return (time.time() - start) * 1000 / calls
+
+def bench(rows, queries):
+    directory = tempfile.mkdtemp()
+    try:
+        connection = build(os.path.join(directory, "bench.db"), rows)
+        cursor = connection.cursor()
+        scan = per_call(lambda: cursor.execute(TOP_QUERY, (TOP_WORDS,)).fetchall(), max(1, queries // 100))
+        cursor.execute("CREATE INDEX idx_EveryTop ON EveryUser(count, word)")
+        indexed = per_call(lambda: cursor.execute(TOP_QUERY, (TOP_WORDS,)).fetchall(), queries)
+
+        board = Store.top_words(cursor, TOP_WORDS)
+        memory = per_call(lambda: sorted(board.iteritems(), key=lambda item: item[1], reverse=True), queries)
+        rand = random.Random(1)
+        batches = [Counter(dict((u"w{0}".format(int(rand.paretovariate(0.5)) % rows), rand.randint(1, 3))
+                                for j in range(BATCH_WORDS))) for i in range(100)]
+        merges = iter(batches)
+
+        def merge():
+            totals = next(merges)
+            cursor.executemany("UPDATE EveryUser SET count = count + ? WHERE word=?",
+                               [(count, word) for word, count in totals.iteritems()])
+            start = time.time()
+            Store.merge_top_words(cursor, board, totals, TOP_WORDS)
+            return time.time() - start
+        merge_ms = sum(merge() for i in range(len(batches))) * 1000 / len(batches)
+        connection.close()
+    finally:
+        shutil.rmtree(directory)
+    print ("{0:>10,} rows: SQL scan {1:9.3f} ms, SQL idx_EveryTop {2:7.3f} ms, "
+           "leaderboard {3:7.4f} ms per answer + {4:.3f} ms per flushed batch").format(
+               rows, scan, indexed, memory, merge_ms)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the !words everyone leaderboard against SQL")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000, 10000000])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    for rows in args.rows:
+        bench(rows, args.queries)
+
+if __name__ == "__main__":
+    main()
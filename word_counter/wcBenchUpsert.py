@@ -0,0 +1,114 @@
+""" Compare the batched UPSERT write path with the per pair REPLACE+COALESCE it replaced.
+
+Usage: python wcBenchUpsert.py [--messages N] [--chatters N] [--vocabulary N]
+
+Generates the same synthetic chat for each path, buffers it into batches of
+FLUSH_THRESHOLD (user, word) pairs like wc_update does, and times writing
+the batches only. Checks that every path ends with the same counts and
+prints (user, word) rows written per second.
+"""
+
+from collections import Counter
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'twitch_chat_bot', 'modules'))
+
+import migratemod as Migrate
+import wordstore as Store
+
+FLUSH_THRESHOLD = 500 # keep in sync with wordCounter.py
+MAX_WORDS = 8 # words per synthetic message
+
+# wc_update_sql before the wordstore module, one pair at a time
+OLD_USER_QUERY = (u"REPLACE INTO WordCount (user, word, count) "
+                  "VALUES (?, ?, COALESCE(((SELECT count FROM WordCount WHERE user=? AND word=?)+?), ?))")
+OLD_WORD_QUERY = (u"REPLACE INTO EveryUser (word, count) "
+                  "VALUES (?, COALESCE(((SELECT count FROM EveryUser WHERE word=?)+?), ?))")
+
+def batches(messages, chatters, vocabulary):
+    """ Counters of (user, word) -> count as wc_update buffers them, the same every call """
+    rand = random.Random(messages)
+    counts = Counter()
+    for i in xrange(messages):
+        user = u"chatter{0}".format(int(rand.paretovariate(0.3)) % chatters)
+        for j in range(rand.randint(1, MAX_WORDS)):
+            counts[(user, u"word{0}".format(int(rand.paretovariate(0.4)) % vocabulary))] += 1
+        if len(counts) >= FLUSH_THRESHOLD:
+            yield counts
+            counts = Counter()
+    if counts:
+        yield counts
+
+def old_write(connection, counts):
+    cursor = connection.cursor()
+    for (user, word), count in counts.iteritems():
+        cursor.execute(OLD_USER_QUERY, (user, word, user, word, count, count))
+        cursor.execute(OLD_WORD_QUERY, (word, word, count, count))
+
+def new_writer(upsert):
+    vocabulary = Store.Vocabulary()
+
+    def write(connection, counts):
+        Store.HAS_UPSERT = upsert
+        Store.add_counts(connection.cursor(), vocabulary, counts)
+    return write
+
+def run(label, path, migrations, write, args):
+    """ Write the corpus to a new database at path, return rows/s and its (pairs, totals) """
+    connection = sqlite3.connect(path)
+    Migrate.tune(connection)
+    Migrate.migrate(connection, migrations)
+    rows = 0
+    elapsed = 0.0
+    for counts in batches(args.messages, args.chatters, args.vocabulary):
+        start = time.time()
+        write(connection, counts)
+        connection.commit()
+        elapsed += time.time() - start
+        rows += len(counts)
+    print "{0:<18} {1:>12,.0f} rows/s ({2:,} rows in {3:.1f}s)".format(label, rows / elapsed, rows, elapsed)
+
+    table = "WordCount" if len(migrations) < 3 else "UserWords"
+    pairs = connection.execute("SELECT user, word, count FROM {0} ORDER BY user, word".format(table)).fetchall()
+    totals = connection.execute("SELECT word, count FROM EveryUser ORDER BY word").fetchall()
+    connection.close()
+    return rows / elapsed, (pairs, totals)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark word count writes on a synthetic chat corpus")
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--chatters", type=int, default=20000)
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words")
+    args = parser.parse_args()
+
+    has_upsert = Store.HAS_UPSERT
+    print "{0:,} messages, sqlite {1}, batches of {2} pairs".format(
+        args.messages, sqlite3.sqlite_version, FLUSH_THRESHOLD)
+    directory = tempfile.mkdtemp()
+    try:
+        old_rate, expected = run("REPLACE+COALESCE", os.path.join(directory, "old.db"),
+                                 Store.MIGRATIONS[:2], old_write, args)
+        paths = [("UPDATE+INSERT", False)]
+        if has_upsert:
+            paths.append(("UPSERT", True))
+        else:
+            print "sqlite {0} has no UPSERT, only the fallback is timed".format(sqlite3.sqlite_version)
+        for label, upsert in paths:
+            rate, result = run(label, os.path.join(directory, label + ".db"),
+                               Store.MIGRATIONS, new_writer(upsert), args)
+            print "{0:<18} {1:.2f}x, {2}".format(
+                "", rate / old_rate, "same counts" if result == expected else "COUNTS DIFFER")
+    finally:
+        Store.HAS_UPSERT = has_upsert
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+""" Backfill WordCount.db from HexChat chat logs.
+
+Usage: python wcImport.py WordCount.db stop_words.csv LOGFILE [LOGFILE ...] [--jobs N]
+
+Reads HexChat logs ("Mon DD HH:MM:SS <nick>\tmessage") or raw IRC lines
+(":nick!user@host PRIVMSG #channel :message") and counts words with the
+same rules as the plugin. Counts are added to whatever the database holds.
+Importing the same log twice counts it twice.
+"""
+
+from collections import Counter
+import argparse
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'twitch_chat_bot', 'modules'))
+
+import migratemod as Migrate
+import tokenizer as Tokenizer
+import wordstore as Store
+
+MAX_CHAR_LENGTH = 16 # keep in sync with wordCounter.py
+BATCH_SIZE = 50000 # rows per executemany call
+LOG_RE = re.compile(r'^(?:[^<\t]*\s)?<[~&@%+]?([^>\s]+)>\t(.*)$') # timestamp <nick>\tmessage
+RAW_RE = re.compile(r'^:([^!\s]+)!\S+ PRIVMSG \S+ :(.*)$')
+
+def read_lines(path):
+    with open(path, 'rb') as file:
+        for line in file:
+            yield line.rstrip('\r\n')
+
+def parse_messages(lines):
+    """ Yield (nick, message) for chat lines, skipping joins, parts and commands """
+    for line in lines:
+        match = LOG_RE.match(line) or RAW_RE.match(line)
+        if match is None:
+            continue
+        nick, message = match.groups()
+        if message.startswith("!"):
+            continue
+        yield nick.lower().decode('utf-8', 'replace'), message
+
+def count_file(args):
+    """ Count (user, word) pairs of one log file, runs in a worker process """
+    path, stop_words = args
+    counts = Counter()
+    messages = 0
+    for nick, message in parse_messages(read_lines(path)):
+        messages += 1
+        for word, count, reason in Tokenizer.count_words(message, stop_words, MAX_CHAR_LENGTH):
+            if not reason:
+                counts[(nick, word)] += count
+    return path, messages, counts
+
+def report(line):
+    print line
+
+def write_counts(db_path, counts):
+    """ Add counts in one transaction, rebuilding secondary indexes afterwards """
+    db_connection = sqlite3.connect(db_path)
+    Migrate.tune(db_connection)
+    Migrate.migrate(db_connection, Store.MIGRATIONS, os.path.basename(db_path), report)
+    db_cursor = db_connection.cursor()
+    Store.drop_indexes(db_cursor)
+
+    vocabulary = Store.Vocabulary()
+    items = counts.items()
+    for i in range(0, len(items), BATCH_SIZE):
+        Store.add_counts(db_cursor, vocabulary, dict(items[i:i + BATCH_SIZE]))
+        print "Wrote {0}/{1} rows".format(min(i + BATCH_SIZE, len(items)), len(items))
+
+    print "Building indexes"
+    Store.create_indexes(db_cursor)
+    db_connection.commit()
+    db_connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Import chat logs into the word counter database")
+    parser.add_argument("database")
+    parser.add_argument("stop_words")
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes, one log file each")
+    args = parser.parse_args()
+
+    start = time.time()
+    stop_words = Tokenizer.StopWords(args.stop_words)
+    jobs = [(path, stop_words) for path in args.logs]
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        results = pool.imap_unordered(count_file, jobs)
+    else:
+        pool = None
+        results = (count_file(job) for job in jobs)
+
+    counts = Counter()
+    messages = 0
+    for path, file_messages, file_counts in results:
+        counts.update(file_counts) # merge step
+        messages += file_messages
+        print "Counted {0} messages from {1}".format(file_messages, path)
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    write_counts(args.database, counts)
+    print "Imported {0} messages, {1} (user, word) pairs in {2:.1f}s".format(
+        messages, len(counts), time.time() - start)
+
+if __name__ == "__main__":
+    main()
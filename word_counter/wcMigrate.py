@@ -0,0 +1,46 @@
+""" Bring word counter databases up to the current schema in place.
+
+Usage: python wcMigrate.py WordCount.db [WordCount_channel.db ...]
+
+The plugin migrates a database the first time it opens it, holding up
+HexChat until it is done. Run this with HexChat closed to migrate large
+databases beforehand and watch the progress.
+"""
+
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'twitch_chat_bot', 'modules'))
+
+import migratemod as Migrate
+import wordstore as Store
+
+def report(line):
+    print line
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    latest = Store.MIGRATIONS[-1][0]
+    for path in sys.argv[1:]:
+        start = time.time()
+        db_connection = sqlite3.connect(path)
+        Migrate.tune(db_connection)
+        version = Migrate.schema_version(db_connection)
+        if version >= latest:
+            print "{0} is already at v{1}".format(path, version)
+        else:
+            Migrate.migrate(db_connection, Store.MIGRATIONS, os.path.basename(path), report)
+            db_connection.execute("ANALYZE")
+            db_connection.commit()
+            print "Compacting {0}".format(path)
+            db_connection.execute("VACUUM") # hand pages freed by the migration back to the file system
+            print "Migrated {0} from v{1} to v{2} in {3:.1f}s".format(path, version, latest, time.time() - start)
+        db_connection.close()
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,31 @@ __module_description__ = "Records the times a user has said a word"
 
 from collections import Counter
 import cPickle as pickle
-import csv
-import datetime
+import glob
 import string
 import os
-import sqlite3
 import sys
 import re
+import time
 
 import hexchat
-import pytz
+
+sys.path.append(os.path.join(
+    hexchat.get_info('configdir'), 'addons', 'modules'))
+
+import busmod as Bus
+import cachemod as Cache
+import commandmod as Command
+import ingest as Ingest
+import logmod as Log
+import migratemod as Migrate
+import profilemod as Profile
+import sendmod as Send
+import sketch as Sketch
+import timemod as Time
+import timeseries as TimeSeries
+import tokenizer as Tokenizer
+import wordstore as Store
 
 # HACK: Set default encoding to UTF-8
 if (sys.getdefaultencoding() != "utf-8"):
@@ -23,62 +38,112 @@ if (sys.getdefaultencoding() != "utf-8"):
     sys.stdout = codecs.getwriter('utf-8')(oldout)  # Set old stdout
     sys.stderr = codecs.getwriter('utf-8')(olderr)  # Set old stderr
 
-def local_time():
-    """ Return current time according to the Pacific time zone """
-    loc_dt = datetime.datetime.now(pytz.timezone('US/Pacific'))
-    return loc_dt
-
-def load_stop_words(file_path):
-    stop_list = []
-    with open(file_path, 'rb') as file:
-        reader = csv.reader(file, delimiter=",")
-        for row in reader:
-            stop_list += row
-    return set(stop_list)
-    
-def find_log_tab():
-    """ Create separate tab for debugging messages """
-    context = hexchat.find_context(channel=LOG_CONTEXT_NAME)
-    if context == None:
-        newtofront = hexchat.get_prefs('gui_tab_newtofront')
-        
-        hexchat.command('set -quiet gui_tab_newtofront 0')
-        hexchat.command('newserver -noconnect {0}'.format(LOG_CONTEXT_NAME))
-        hexchat.command('set -quiet gui_tab_newtofront {}'.format(newtofront))
-        return hexchat.find_context(channel=LOG_CONTEXT_NAME)
-    else:
-        return context
-
 # setup and constants
-COOLDOWN = 12
+COOLDOWN = 3 # seconds between commands, the outbox keeps replies under Twitch's rate limit
 MAX_CHAR_LENGTH = 16
+FLUSH_INTERVAL = 30000 # ms between writes of buffered counts to the database
+FLUSH_THRESHOLD = 500 # write early once this many (user, word) pairs are buffered
+THREADED_INGEST = False # count words on a background thread instead of the HexChat thread
+INGEST_QUEUE_SIZE = 2000
+INGEST_POLICY = Ingest.DROP # or Ingest.BLOCK to hold up the hook while the queue is full
+SYNC_TIMEOUT = 2.0 # seconds to wait for the ingest thread to flush before a query
+CACHE_SIZE = 256 # !words results kept in memory
+CACHE_TTL = 300 # seconds before a cached !words result is queried again
+TOP_WORDS = 10 # size of the !words everyone leaderboard
+PARTITION_BY_CHANNEL = False # one WordCount_<channel>.db per channel instead of one WordCount.db, see readme
+ROLLUP_DEPTH = 4 # "all" queries merge this many times the usual rows from each channel
+TIME_BUCKETS = True # also count words per hour/day for !words ... today / week / trending
+MAINTAIN_INTERVAL = 600000 # ms between expiring, compacting and pruning time buckets
+TRENDING_MIN = 5 # times a word must be said in the last day to be trending
+WINDOW_OPTIONS = {"today": "day", "week": "week"} # command option -> TimeSeries window
+WINDOW_LABELS = {"day": "today", "week": "this week"}
+APPROXIMATE = False # fixed memory counting for very large channels, only the top pairs and words keep rows
+SKETCH_WIDTH = 65536 # counters per sketch row, estimates are at most e / width * words counted too high
+SKETCH_DEPTH = 4 # sketch rows, that bound holds with probability 1 - e^-depth
+HEAVY_PAIRS = 20000 # (user, word) rows kept in WordCount in approximate mode
+HEAVY_WORDS = 2000 # word rows kept in EveryUser in approximate mode
+SKETCH_SAVE_INTERVAL = 300000 # ms between saving sketches to the database
 DIR_PATH = hexchat.get_info("configdir")
 DB_PATH = DIR_PATH + "/WordCount.db"
+PARTITION_PATH = DIR_PATH + "/WordCount_{0}.db"
+PARTITION_RE = re.compile(r'[^\w-]') # characters not allowed in partition file names
 STOP_WORD_PATH = DIR_PATH + "/stop_words.csv"
-STOP_WORDS = load_stop_words(STOP_WORD_PATH)
+STOP_WORDS = Tokenizer.StopWords(STOP_WORD_PATH) # words and "prefix*" rules, reloaded when the file changes
+STOP_WORD_CHECK_INTERVAL = 10000 # ms between checks of the stop word file's mtime
 LOG_CONTEXT_NAME = ":wordcount:"
-LOG_CONTEXT = hexchat.find_context(LOG_CONTEXT_NAME)
+LOG_LEVEL = Log.DEBUG # Log.INFO hides the line per counted word, Log.OFF logs nothing
+LOG_TAB = True # print the log in the LOG_CONTEXT_NAME tab
+LOG_FILE = None # e.g. DIR_PATH + "/wordcount.log" to also keep a rotating log file
+LOG_FORMAT = u"\0030Log\0032 {0}\0030 from\0037 {1}\0030. Count =\0034 {2}"
+DISCARD_FORMAT = u"\0030Discard\0032 {0}\0030 from\0037 {1}\0030. {2}"
 LOW_WIDTH_SPACE = u"\uFEFF" # insert into nicknames to avoid highlighting user extra times
-UNI_RE = re.compile(r'[^\W\d_]+') # match groups of unicode letters
-HTTP_RE = re.compile(r'https?:\/\/.*[\r\n]*') # re.sub() remove URLs
-CMD_RE = re.compile(r'\!\w+\s') # remove other chat commands
-
-cooldown_time = local_time()
-log_context = find_log_tab()
-db_connection = sqlite3.connect(DB_PATH)
-db_cursor = db_connection.cursor()
-db_cursor.execute(("CREATE TABLE IF NOT EXISTS WordCount (user TEXT, "
-                                                         "word TEXT, "
-                                                         "count INTEGER, "
-                                                         "UNIQUE(user, word) ON CONFLICT REPLACE)"))
-db_cursor.execute(("CREATE TABLE IF NOT EXISTS EveryUser (word TEXT UNIQUE, count INTEGER)"))
-db_cursor.execute(("CREATE INDEX IF NOT EXISTS idx_UserTop ON WordCount(user, word)"))
-db_cursor.execute(("CREATE INDEX IF NOT EXISTS idx_WordTop ON WordCount(word, count)"))
+
+cooldown_time = 0.0 # Time.monotonic() until which commands are ignored
+wc_log = Log.TabLog(LOG_CONTEXT_NAME, LOG_LEVEL, LOG_TAB, LOG_FILE) # batched, safe from the ingest thread
+def db_setup(connection, path):
+    """ Tune a new connection and bring its database to the current schema """
+    Migrate.tune(connection)
+    Migrate.migrate(connection, Store.MIGRATIONS, os.path.basename(path), wc_log.info)
+    db_cursor = connection.cursor()
+    # optional tables, created whenever their feature is switched on
+    if APPROXIMATE:
+        Sketch.create_tables(db_cursor)
+    if TIME_BUCKETS:
+        TimeSeries.create_tables(db_cursor)
+
+db_pool = Store.ConnectionPool(db_setup) # per thread, per partition connections
+pending_counts = {} # partition -> Counter of (user, word) -> count not yet written to the database
+ingest = None # Ingest.IngestWorker when THREADED_INGEST is on
+query_cache = Cache.LRUCache(CACHE_SIZE, CACHE_TTL) # (partition, query kind, argument) -> rows
+top_words = {} # partition -> {word: count} of the TOP_WORDS most said words, boards are rebound not mutated
+outbox = Send.Outbox() # rate limited replies, /wc_outbox
+profiler = Profile.Profiler(("filter", "parse", "count", "tokenize", "persist", "commands", "log")) # /wc_profile
+approx = {} # partition -> (pairs, words) Sketch.ApproximateCounter, owned by the thread that flushes
+vocabularies = {} # partition -> Store.Vocabulary, owned by the thread that flushes
+
+def partition_name(channel):
+    """ Return the partition a channel's counts are kept in, "" for the shared WordCount.db """
+    if not PARTITION_BY_CHANNEL:
+        return ""
+    return PARTITION_RE.sub("_", channel.lstrip("#").lower())
+
+def partition_path(partition):
+    if partition:
+        return PARTITION_PATH.format(partition)
+    return DB_PATH
+
+def partition_paths():
+    """ Database files of every partition, including those not used since loading """
+    paths = glob.glob(PARTITION_PATH.format("*"))
+    if os.path.exists(DB_PATH):
+        paths.append(DB_PATH)
+    return paths
+
+def db_for(partition):
+    """ Connection to a partition for the calling thread """
+    return db_pool.get(partition_path(partition))
+
+def vocabulary_for(partition):
+    vocabulary = vocabularies.get(partition)
+    if vocabulary is None:
+        vocabulary = vocabularies[partition] = Store.Vocabulary()
+    return vocabulary
+
+def top_words_seed(partition, db_cursor):
+    """ Load the !words everyone leaderboard of a partition from the database """
+    top_words[partition] = Store.top_words(db_cursor, TOP_WORDS)
+
+def top_words_update(partition, db_cursor, totals):
+    """ Merge a written batch of {word: added count} into the leaderboard """
+    if partition not in top_words:
+        top_words_seed(partition, db_cursor)
+        return
+    top_words[partition] = Store.merge_top_words(db_cursor, top_words[partition], totals, TOP_WORDS)
 
 
 def on_cooldown():
     """ Return true if script has made a response recently """
-    time_now = local_time()
+    time_now = Time.monotonic()
     if cooldown_time > time_now:
         return True
     else:
@@ -87,22 +152,232 @@ def on_cooldown():
 def cooldown_update():
     """ Update earliest time a new command can be called """
     global cooldown_time
-    time_now = local_time()
-    cooldown_time = time_now + datetime.timedelta(seconds=COOLDOWN)
+    cooldown_time = Time.monotonic() + COOLDOWN
+
+def wc_flush(userdata=None):
+    """ Write buffered word counts to the database, one transaction per partition """
+    if ingest is not None and not ingest.on_worker_thread():
+        ingest.call(wc_flush) # ingest thread owns the buffers and its connections
+        return 1
+    for partition in pending_counts.keys():
+        wc_flush_partition(partition)
+    return 1 # keep hook_timer running
+
+def wc_flush_partition(partition):
+    """ Write one partition's buffered counts, each partition is its own transaction """
+    counts = pending_counts.pop(partition, None)
+    if not counts:
+        return
+    start = profiler.start()
+    connection = db_for(partition)
+    cursor = connection.cursor()
+    if APPROXIMATE:
+        totals = wc_flush_approximate(partition, cursor, counts)
+    else:
+        totals = Store.add_counts(cursor, vocabulary_for(partition), counts)
+        top_words_update(partition, cursor, totals)
+    if TIME_BUCKETS:
+        TimeSeries.add_counts(cursor, counts, totals, int(time.time()))
+    connection.commit()
+    profiler.stop("persist", start)
+    windows = (None,) + tuple(WINDOW_LABELS)
+    for scope in (partition, None): # None is the "all" rollup, which includes this partition
+        for user, word in counts:
+            for window in windows:
+                query_cache.invalidate((scope, query_kind("user", window), user))
+                query_cache.invalidate((scope, query_kind("word", window), word))
+        for window in windows:
+            query_cache.invalidate((scope, query_kind("everyone", window), None))
+        query_cache.invalidate((scope, "trending", None))
+
+def approx_for(partition, db_cursor):
+    """ Sketches of a partition, loaded from the database on first use """
+    state = approx.get(partition)
+    if state is not None:
+        return state
+    pairs = Sketch.ApproximateCounter(SKETCH_WIDTH, SKETCH_DEPTH, HEAVY_PAIRS)
+    words = Sketch.ApproximateCounter(SKETCH_WIDTH, SKETCH_DEPTH, HEAVY_WORDS)
+    if Sketch.load(db_cursor, "pairs", pairs.sketch) and Sketch.load(db_cursor, "words", words.sketch):
+        db_cursor.execute("SELECT user, word, count FROM UserWords")
+        for user, word, count in db_cursor.fetchall():
+            pairs.hitters.set((user, word), count)
+        db_cursor.execute("SELECT word, count FROM EveryUser")
+        for word, count in db_cursor.fetchall():
+            words.hitters.set(word, count)
+    else:
+        # first use of approximate mode: sketch the exact counts, then keep only the top rows
+        db_cursor.execute("SELECT user, word, count FROM UserWords")
+        for user, word, count in db_cursor:
+            pairs.add((user, word), count)
+        db_cursor.execute("SELECT word, count FROM EveryUser")
+        for word, count in db_cursor:
+            words.add(word, count)
+        db_cursor.execute("DELETE FROM WordCount")
+        Store.set_counts(db_cursor, vocabulary_for(partition), pairs.hitters.counts)
+        db_cursor.execute("DELETE FROM EveryUser")
+        db_cursor.executemany("INSERT INTO EveryUser (word, count) VALUES (?, ?)", words.hitters.counts.iteritems())
+        Sketch.save(db_cursor, "pairs", pairs.sketch)
+        Sketch.save(db_cursor, "words", words.sketch)
+    approx[partition] = (pairs, words)
+    top_words[partition] = dict(words.hitters.top(TOP_WORDS))
+    return pairs, words
+
+def wc_flush_approximate(partition, db_cursor, counts):
+    """ Sketch a batch of counts and rewrite the rows of the pairs and words that are on top,
+    return the per word totals of the batch """
+    pairs, words = approx_for(partition, db_cursor)
+    totals = Counter()
+    for (user, word), count in counts.iteritems():
+        totals[word] += count
+
+    kept_pairs, dropped_pairs = top_changes(pairs, counts)
+    kept_words, dropped_words = top_changes(words, totals)
+    vocabulary = vocabulary_for(partition)
+    Store.delete_pairs(db_cursor, vocabulary, dropped_pairs)
+    Store.set_counts(db_cursor, vocabulary, kept_pairs)
+    db_cursor.executemany("DELETE FROM EveryUser WHERE word=?", [(word,) for word in dropped_words])
+    db_cursor.executemany("REPLACE INTO EveryUser (word, count) VALUES (?, ?)", kept_words.iteritems())
+    top_words[partition] = dict(words.hitters.top(TOP_WORDS))
+
+    for scope in (partition, None):
+        for user, word in dropped_pairs:
+            query_cache.invalidate((scope, "user", user))
+            query_cache.invalidate((scope, "word", word))
+    return totals
+
+def top_changes(counter, counts):
+    """ Add counts to an ApproximateCounter, return ({key: count} now on top, keys that fell off) """
+    kept = {}
+    dropped = set()
+    for key, count in counts.iteritems():
+        estimate, tracked, evicted = counter.add(key, count)
+        if evicted is not None:
+            kept.pop(evicted, None)
+            dropped.add(evicted)
+        if tracked:
+            kept[key] = counter.hitters.get(key)
+            dropped.discard(key)
+    return kept, dropped
+
+def wc_save_sketches(userdata=None):
+    """ Write the sketches of every loaded partition to its database """
+    if ingest is not None and not ingest.on_worker_thread():
+        ingest.call(wc_save_sketches)
+        return 1
+    for partition, (pairs, words) in approx.items():
+        connection = db_for(partition)
+        cursor = connection.cursor()
+        Sketch.save(cursor, "pairs", pairs.sketch)
+        Sketch.save(cursor, "words", words.sketch)
+        connection.commit()
+    return 1 # keep hook_timer running
+
+def approx_reset():
+    """ Save and forget the sketches so they are reloaded from the tables, e.g. after a delete """
+    wc_save_sketches()
+    approx.clear()
+
+def stop_words_reload(userdata):
+    """ Pick up edits of the stop word file without reloading the plugin """
+    if STOP_WORDS.reload_if_changed():
+        wc_log.info("Reloaded " + STOP_WORDS.summary())
+    return 1 # keep hook_timer running
+
+def wc_maintain(userdata=None):
+    """ Expire, compact and prune time buckets of every partition """
+    if ingest is not None and not ingest.on_worker_thread():
+        ingest.call(wc_maintain)
+        return 1
+    now = int(time.time())
+    for path in partition_paths():
+        connection = db_pool.get(path)
+        TimeSeries.maintain(connection.cursor(), now)
+        connection.commit()
+    query_cache.clear() # windows moved on
+    return 1 # keep hook_timer running
+
+def wc_sync():
+    """ Make sure buffered counts are in the database before reading or deleting """
+    if ingest is not None:
+        ingest.call(wc_flush, wait=SYNC_TIMEOUT)
+    else:
+        wc_flush()
+
+def ingest_stop():
+    wc_flush()
+    if APPROXIMATE:
+        wc_save_sketches()
+    db_pool.close_thread()
+
+def ingest_message(data):
+    """ Count the words of a Bus.Message on the ingest thread """
+    wc_update(data)
+
+def ingest_stats_cb(word, word_eol, userdata):
+    """ Print ingest queue counters """
+    if ingest is None:
+        print "Threaded ingest is off."
+    else:
+        print ("Ingest queue: {depth}/{maxsize} queued, {processed} processed, "
+               "{dropped} dropped, {errors} errors").format(**ingest.stats())
+    return hexchat.EAT_ALL
+
+def stats_cb(word, word_eol, userdata):
+    """ Print !words result cache counters """
+    print "Query cache: " + query_cache.summary()
+    for partition, (pairs, words) in approx.items():
+        over, probability = pairs.sketch.error_bound()
+        print ("Sketch {0}: {1} words counted in {2} KB, {3} pairs kept, "
+               "counts at most {4} too high ({5:.0%} sure)").format(
+                   partition or "WordCount.db", pairs.sketch.total,
+                   (pairs.sketch.nbytes() + words.sketch.nbytes()) / 1024, len(pairs.hitters), over, probability)
+    return hexchat.EAT_ALL
+
+def outbox_stats_cb(word, word_eol, userdata):
+    """ Print outbound message counters """
+    print "Outbox: " + outbox.summary()
+    return hexchat.EAT_ALL
+
+def profile_cb(word, word_eol, userdata):
+    """ Switch stage timing on or off, print or export it to the log tab """
+    context = wc_log.tab_context()
+    for line in profiler.command(word[1:]):
+        context.prnt(line)
+    return hexchat.EAT_ALL
 
 def unload_cb(userdata):
     """ Commit and close database when unloading """
-    db_connection.commit()
-    db_connection.close()
+    outbox.close()
+    wc_log.close()
+    if ingest is not None:
+        ingest.stop()
+    else:
+        wc_flush()
+        if APPROXIMATE:
+            wc_save_sketches()
+    db_pool.close_thread()
     hexchat.prnt(__module_name__ + " v" + __module_version__ + " has been unloaded.")
 
+def delete_all(sql_query, params):
+    """ Run a delete in every partition """
+    wc_sync()
+    if APPROXIMATE:
+        if ingest is not None:
+            ingest.call(approx_reset, wait=SYNC_TIMEOUT)
+        else:
+            approx_reset()
+    for path in partition_paths():
+        connection = db_pool.get(path)
+        connection.execute(sql_query, params)
+        connection.commit()
+    query_cache.clear()
+
 def delete_user_cb(word, word_eol, userdata):
     """ Delete user from dictionary """
     nick = word_eol[1]
     sql_query = ("DELETE FROM WordCount "
-                 "WHERE user=?")
-    db_cursor.execute(sql_query, (nick,))
-    db_connection.commit()
+                 "WHERE user_id=(SELECT id FROM Users WHERE nick=?)")
+    delete_all(sql_query, (nick,))
     print "Deleted {0} from WC database".format(nick)
     return hexchat.EAT_ALL
 
@@ -111,12 +386,16 @@ def delete_entry_cb(word, word_eol, userdata):
     nick = word[1]
     word = word[2]
     sql_query = ("DELETE FROM WordCount "
-                 "WHERE user=? AND word=?")
-    db_cursor.execute(sql_query, (nick, word))
-    db_connection.commit()
+                 "WHERE user_id=(SELECT id FROM Users WHERE nick=?) "
+                 "AND word_id=(SELECT id FROM Words WHERE text=?)")
+    delete_all(sql_query, (nick, word))
     print "Deleted {0}'s count of '{1}' from WC database".format(nick, word)
     return hexchat.EAT_ALL
 
+def say(line):
+    """ Queue message for the current channel """
+    outbox.say(line)
+
 def break_nickname(nick):
     """ Insert zero-width spaces into name to avoid extra IRC highlights """
     new_nick = u""
@@ -125,58 +404,38 @@ def break_nickname(nick):
     return new_nick
 
 def wc_update(data):
-    """ Update count of words said by user """
-    msg_no_cmds = CMD_RE.sub(' ', data['message'].lower())
-    msg_no_urls = HTTP_RE.sub('', msg_no_cmds)
-    result = filter(lambda x: len(x.decode('utf-8')) > 2, UNI_RE.findall(msg_no_urls))
-    freq = Counter(result)
-    user = data['nick']
-    log_context = find_log_tab()
-
-    for word in freq:
-        if word in STOP_WORDS or word.startswith("!") or word.startswith("http"):
-            continue
-        elif freq[word] > 2:
-            log_wc_update("Discard", freq[word], user, "Spam", word)
-        elif len(word.decode('utf-8')) > MAX_CHAR_LENGTH:
-            log_wc_update("Discard", freq[word], user, "Too long", word)
-        elif word != " ":
-            log_wc_update("Log", freq[word], user, "", word)
-            wc_update_sql(data['nick'], word.decode('utf-8'), freq[word])
-    db_connection.commit()
+    """ Update count of words said by user, data is a Bus.Message """
+    user = data.nick
+    partition = partition_name(data.channel)
+    counts = pending_counts.get(partition)
+    if counts is None:
+        counts = pending_counts[partition] = Counter()
+
+    start = profiler.start()
+    tokens = Tokenizer.count_words(data.message, STOP_WORDS, MAX_CHAR_LENGTH)
+    profiler.stop("tokenize", start)
+    verbose = wc_log.enabled(Log.DEBUG)
+    for word, count, reason in tokens:
+        if reason:
+            if verbose:
+                log_wc_update("Discard", count, user, reason, word)
+        else:
+            if verbose:
+                log_wc_update("Log", count, user, "", word)
+            counts[(user, word)] += count
 
-def log_wc_update(action, count, user, reason, word):
-    """ Print to screen the results of wc_update """
-    log_context = find_log_tab()
-    color = ["\0030", "\0032", "\0037", "\0034"]
+    if len(counts) >= FLUSH_THRESHOLD:
+        wc_flush_partition(partition)
 
+def log_wc_update(action, count, user, reason, word):
+    """ Queue the results of wc_update for the log tab, formatted when it is printed """
+    start = profiler.start()
     if action == "Log":
-        reason = "Count ={0} {1}".format(color[3], count)
-
-    log = u"{c0}{act}{c1} {wrd}{c0} from{c2} {usr}{c0}. {rsn}".format(c0=color[0],
-                                                                      c1=color[1],
-                                                                      c2=color[2],
-                                                                      act=action,
-                                                                      usr=user,
-                                                                      rsn=reason,
-                                                                      wrd=word)
-    log_context.prnt(log)
+        wc_log.debug(LOG_FORMAT, word, user, count)
+    else:
+        wc_log.debug(DISCARD_FORMAT, word, user, reason)
+    profiler.stop("log", start)
             
-def wc_update_sql(user, word, count): 
-    # sqlite3 does not support UPSERT, instead SELECT for existing field
-    sql_query = (u"REPLACE INTO WordCount (user, word, count) "
-                 "VALUES (?, "
-                         "?, "
-                         "COALESCE(((SELECT count FROM WordCount WHERE user=? AND word=?)+?), ?)"
-                         ")")
-    db_cursor.execute(sql_query, (user, word, user, word, count, count))
-    # different table for faster aggregate data
-    sql_query = (u"REPLACE INTO EveryUser (word, count) "
-                 "VALUES (?, "
-                 "COALESCE(((SELECT count FROM EveryUser WHERE word=?)+?), ?)"
-                 ")")
-    db_cursor.execute(sql_query, (word, word, count, count))
-
 def report_list(items, break_text):
     """ Generate message based on a list of items """
     report = ""
@@ -189,119 +448,240 @@ def report_list(items, break_text):
         report += partial
     return report
 
-def user_top_words(caller, nick):
+def query_kind(kind, window):
+    """ Result cache kind of a query over a time window, or over all time if window is None """
+    if window is None:
+        return kind
+    return kind + ":" + window
+
+def window_label(window):
+    if window is None:
+        return ""
+    return " " + WINDOW_LABELS[window]
+
+def cached_query(partition, kind, key, sql_query, params=(), limit=8):
+    """ Run a top-N query through the result cache.
+
+    partition None rolls up every channel by adding the top rows of each,
+    so rows that are not near the top of any one channel can be missed.
+    """
+    results = query_cache.get((partition, kind, key))
+    if results is None:
+        generation = query_cache.generation() # a flush on the ingest thread may invalidate key while this reads
+        if partition is None:
+            totals = Counter()
+            for path in partition_paths():
+                rows = db_pool.get(path).execute(sql_query, params + (limit * ROLLUP_DEPTH,))
+                for text, count in rows:
+                    totals[text] += count
+            results = totals.most_common(limit)
+        else:
+            results = db_for(partition).execute(sql_query, params + (limit,)).fetchall()
+        query_cache.put((partition, kind, key), results, generation)
+    return results
+
+def approx_note(partition, name):
+    """ Reply suffix saying how far all-time counts of the "pairs" or "words" sketch can be too high """
+    if not APPROXIMATE:
+        return ""
+    if partition is None:
+        paths = partition_paths()
+    else:
+        paths = [partition_path(partition)]
+    loaded = dict((partition_path(loaded_partition), state) for loaded_partition, state in approx.items())
+    total = 0
+    for path in paths:
+        if path in loaded:
+            total += loaded[path][name == "words"].sketch.total
+        else:
+            # not flushed to since loading, the saved sketch is current
+            row = db_pool.get(path).execute("SELECT total FROM Sketch WHERE name=?", (name,)).fetchone()
+            total += row[0] if row else 0
+    over = Sketch.error_bound(SKETCH_WIDTH, SKETCH_DEPTH, total)[0]
+    return "(estimates, at most {0} too high)".format(over) # follows the ", " report_list ends with
+
+def user_top_words(caller, partition, nick, window=None):
     """ Return the top words a user has said """
-    sql_query = ("SELECT word, count "
-                 "FROM WordCount "
-                 "WHERE user=? "
-                 "ORDER BY count DESC "
-                 "LIMIT 8")
-    db_cursor.execute(sql_query, (nick.lower(),))
-    results = db_cursor.fetchall()
-
-    msg = "say {0} -> This user's top words: ".format(caller) + report_list(results, False)
-    hexchat.command(msg)
+    if window is None:
+        sql_query = ("SELECT Words.text, WordCount.count "
+                     "FROM WordCount JOIN Words ON Words.id = WordCount.word_id "
+                     "WHERE WordCount.user_id=(SELECT id FROM Users WHERE nick=?) "
+                     "ORDER BY WordCount.count DESC "
+                     "LIMIT ?")
+        params = (nick.lower(),)
+    else:
+        sql_query = ("SELECT word, count "
+                     "FROM WindowCount "
+                     "WHERE window=? AND user=? "
+                     "ORDER BY count DESC "
+                     "LIMIT ?")
+        params = (window, nick.lower())
+    results = cached_query(partition, query_kind("user", window), nick.lower(), sql_query, params)
+
+    msg = "{0} -> This user's top words{1}: ".format(caller, window_label(window)) + report_list(results, False)
+    if window is None:
+        msg += approx_note(partition, "pairs")
+    say(msg)
     cooldown_update()
 
-def word_top_users(caller, word):
+def word_top_users(caller, partition, word, window=None):
     """ Return the top ?? users that have said word """
 
     if len(word) < 3 or len(word) > MAX_CHAR_LENGTH:
-        hexchat.command("say {0} -> Words of length 3 to {1} are recorded.".format(caller, MAX_CHAR_LENGTH))
+        say("{0} -> Words of length 3 to {1} are recorded.".format(caller, MAX_CHAR_LENGTH))
         cooldown_update()
         return
 
-    if word in STOP_WORDS or word.startswith("!"):
-        msg = "say {0} -> '{1}' is excluded for being too common or another command.".format(caller, word)
-        hexchat.command(msg)
+    word_key = word.decode('utf-8').lower()
+    if word_key in STOP_WORDS:
+        msg = "{0} -> '{1}' is excluded for being too common or another command.".format(caller, word)
+        say(msg)
         cooldown_update()
         return
 
     if not word.isalpha():
-        msg = "say {0} -> Numbers and punctuation are not included in records.".format(caller)
-        hexchat.command(msg)
+        msg = "{0} -> Numbers and punctuation are not included in records.".format(caller)
+        say(msg)
         cooldown_update()
         return
 
-    sql_query = ("SELECT user, count "
-                 "FROM WordCount "
-                 "WHERE word=? "
-                 "ORDER BY count DESC "
-                 "LIMIT 8")
-    db_cursor.execute(sql_query, (word.decode('utf-8').lower(),))
-    results = db_cursor.fetchall()
+    if window is None:
+        sql_query = ("SELECT Users.nick, WordCount.count "
+                     "FROM WordCount JOIN Users ON Users.id = WordCount.user_id "
+                     "WHERE WordCount.word_id=(SELECT id FROM Words WHERE text=?) "
+                     "ORDER BY WordCount.count DESC "
+                     "LIMIT ?")
+        params = (word_key,)
+    else:
+        sql_query = ("SELECT user, count "
+                     "FROM WindowCount "
+                     "WHERE window=? AND word=? "
+                     "ORDER BY count DESC "
+                     "LIMIT ?")
+        params = (window, word_key)
+    results = cached_query(partition, query_kind("word", window), word_key, sql_query, params)
 
     results_str = report_list(results, True)
-    msg = "say {0} -> Top users of '{1}': {2}".format(caller, word.lower(), results_str)
-    hexchat.command(msg)
+    msg = "{0} -> Top users of '{1}'{2}: {3}".format(caller, word.lower(), window_label(window), results_str)
+    if window is None:
+        msg += approx_note(partition, "pairs")
+    say(msg)
     cooldown_update()
 
-def most_spoken_words(caller):
-    """ Return the top 10 words said by all users """
-    sql_query = ("SELECT word, count "
-                 "FROM EveryUser "
-                 "ORDER BY count DESC "
-                 "LIMIT 10")
-    db_cursor.execute(sql_query)
-    results = db_cursor.fetchall()
-    
-    msg = "say {0} -> Top words recorded: {1}".format(caller, report_list(results, False))
-    hexchat.command(msg)
+def most_spoken_words(caller, partition, window=None):
+    """ Return the top 10 words said by all users, kept in memory by wc_flush """
+    if window is not None:
+        sql_query = ("SELECT word, count "
+                     "FROM WindowWords "
+                     "WHERE window=? "
+                     "ORDER BY count DESC "
+                     "LIMIT ?")
+        results = cached_query(partition, query_kind("everyone", window), None, sql_query, (window,), TOP_WORDS)
+    elif partition is None:
+        sql_query = ("SELECT word, count "
+                     "FROM EveryUser "
+                     "ORDER BY count DESC "
+                     "LIMIT ?")
+        results = cached_query(None, "everyone", None, sql_query, limit=TOP_WORDS)
+    else:
+        if partition not in top_words:
+            top_words_seed(partition, db_for(partition).cursor())
+        results = sorted(top_words[partition].iteritems(), key=lambda item: item[1], reverse=True)
+
+    msg = "{0} -> Top words recorded{1}: {2}".format(caller, window_label(window), report_list(results, False))
+    if window is None:
+        msg += approx_note(partition, "words")
+    say(msg)
+    cooldown_update()
+
+def trending_words(caller, partition):
+    """ Return words said much more in the last day than over the last week """
+    sql_query = ("SELECT day.word, day.count "
+                 "FROM WindowWords day JOIN WindowWords week "
+                 "ON week.window='week' AND week.word=day.word "
+                 "WHERE day.window='day' AND day.count >= ? "
+                 "ORDER BY day.count * 7.0 / (week.count + 7) DESC "
+                 "LIMIT ?")
+    results = cached_query(partition, "trending", None, sql_query, (TRENDING_MIN,), TOP_WORDS)
+
+    msg = "{0} -> Trending today: {1}".format(caller, report_list(results, False))
+    say(msg)
     cooldown_update()
 
 def wc_print_usage(caller):
     """ Print syntax for using !words commands """
-    msg = "say {0} -> Usage: !words user [USERNAME] / !words word [WORD] / !words everyone".format(caller)
-    hexchat.command(msg)
+    msg = ("{0} -> Usage: !words user [USERNAME] / !words word [WORD] / !words everyone / !words trending, "
+           "add 'today' or 'week' for recent counts and 'all' for every channel").format(caller)
+    say(msg)
     cooldown_update()
 
-def parse(word, word_eol, userdata):
-    """ Prepare messages for processing """
-    str_data = word_eol[0].replace("!"," ", 1).split(None,4)    
-    data = {
-        "nick" : str_data[0].lstrip(":").lower().decode('ascii').encode('utf-8'),
-        "host" : str_data[1].decode('ascii').encode('utf-8'),
-        "type" : str_data[2].decode('ascii').encode('utf-8'),
-        "channel" : str_data[3].decode('ascii').encode('utf-8'),
-        "message" : str_data[4][1:].encode('utf-8')
-        }
-    if is_ignored(data['nick']):
-       return 
-    if not data['message'].startswith("!"):
-       wc_update(data)
-    if data['message'].startswith("!") and not on_cooldown():
-       route(data)
-
-def is_ignored(user):
-    ignore_list = hexchat.get_list("ignore")
-    for item in ignore_list:
-        if user in item.mask:
-            return True
-    return False
+def count_cb(data):
+    """ Count the words of chat lines, on the ingest thread when THREADED_INGEST is on """
+    if ingest is not None:
+        ingest.submit(data)
+    else:
+        wc_update(data)
+
+def route_on_cooldown(command, data):
+    return on_cooldown()
+
+router = Command.Router("!", route_on_cooldown)
 
 def route(data):
     """ Handle command calls """
-    cmd_data = data['message'].split()
+    router.dispatch(data)
+
+@router.command("!words")
+def words_cmd(data, cmd_data):
     length = len(cmd_data)
-    
-    if cmd_data[0] != "!words":
-        return
+    wc_sync() # answer from up to date counts
+    partition = partition_name(data.channel)
+    window = None
+    first_option = 3 if length >= 2 and cmd_data[1] in ("user", "word") else 2
+    for option in cmd_data[first_option:]:
+        if option == "all":
+            partition = None # roll up every channel
+        elif option in WINDOW_OPTIONS:
+            window = WINDOW_OPTIONS[option]
+
+    if (window is not None or cmd_data[1:2] == ["trending"]) and not TIME_BUCKETS:
+        say("{0} -> Recent word counts are not being recorded.".format(data.nick))
+        cooldown_update()
     elif length >= 2 and cmd_data[1] == "everyone":
-            most_spoken_words(data['nick'])
+            most_spoken_words(data.nick, partition, window)
+    elif length >= 2 and cmd_data[1] == "trending":
+            trending_words(data.nick, partition)
     elif length >= 3:
         if cmd_data[1] == "user":
-            user_top_words(data['nick'], cmd_data[2])
+            user_top_words(data.nick, partition, cmd_data[2], window)
         elif cmd_data[1] == "word":
-            word_top_users(data['nick'], cmd_data[2])
+            word_top_users(data.nick, partition, cmd_data[2], window)
         else:
-            wc_print_usage(data['nick'])
+            wc_print_usage(data.nick)
     else:
-        wc_print_usage(data['nick'])
+        wc_print_usage(data.nick)
+
 
+if THREADED_INGEST:
+    ingest = Ingest.IngestWorker(ingest_message, INGEST_QUEUE_SIZE, INGEST_POLICY,
+                                 on_stop=ingest_stop, name="wc_ingest")
+    ingest.start()
 
-hexchat.hook_server('PRIVMSG', parse)
+Bus.subscribe("count", count_cb, Bus.CHAT, profiler)
+Bus.subscribe("commands", route, Bus.COMMANDS, profiler) # hexchat API is not thread safe, commands stay on this thread
 hexchat.hook_unload(unload_cb)
+hexchat.hook_timer(FLUSH_INTERVAL, wc_flush)
+hexchat.hook_timer(STOP_WORD_CHECK_INTERVAL, stop_words_reload)
+wc_log.start()
+if TIME_BUCKETS:
+    hexchat.hook_timer(MAINTAIN_INTERVAL, wc_maintain)
+if APPROXIMATE:
+    hexchat.hook_timer(SKETCH_SAVE_INTERVAL, wc_save_sketches)
 hexchat.hook_command("wc_delete_user", delete_user_cb, help="/wc_delete_user [name] Removes user from database")
 hexchat.hook_command("wc_delete_entry", delete_entry_cb, help="/wc_delete_entry [name] [word] Removes entry from database")
+hexchat.hook_command("wc_stats", stats_cb, help="/wc_stats Shows hit, miss and eviction counts of the !words result cache")
+hexchat.hook_command("wc_profile", profile_cb, help="/wc_profile [on|off|reset|show|export PATH] Times filter, parse, count, tokenize, persist, commands and log stages")
+hexchat.hook_command("wc_outbox", outbox_stats_cb, help="/wc_outbox Shows waiting, sent, merged and dropped replies")
+hexchat.hook_command("wc_ingest", ingest_stats_cb, help="/wc_ingest Shows queue depth and dropped messages of threaded ingest")
 
 hexchat.prnt(__module_name__ + " v" + __module_version__ + " has been loaded.")
\ No newline at end of file